@@ -1,81 +1,152 @@
+import time
+
+# wall time of the imports and of the consts loading, reported at the end of the run
+_import_start = time.perf_counter()
+
 import concurrent.futures
+import contextlib
 import datetime
 import getopt
-import smtplib
+import multiprocessing
+import multiprocessing.util
+import queue
 import sys
+import threading
 import traceback
 
-import git
 from os import path
 from pathlib import Path
 import os
 import dockerfile
 from collections import Counter
-import nltk
-import pandas as pd
-from tqdm import tqdm
 
-nltk.download('punkt')
-import string
 import subprocess
 import json
 import shutil
 import yaml
-from filelock import Timeout, FileLock
-import networkx as nx
-from threading import Lock
-
-with open('./consts/db.csv') as db_file:
-    dbs = [db.lower() for db in db_file.read().splitlines()]
-with open('./consts/db-2.csv') as db_file:
-    dbs += [db.lower() for db in db_file.read().splitlines()]
-dbs = list(set(dbs))
-with open('./consts/bus.csv') as bus_file:
-    buses = [bus.lower() for bus in bus_file.read().splitlines()]
-with open('./consts/lang.csv') as lang_file:
-    langs = [lang.lower() for lang in lang_file.read().splitlines()]
-with open('./consts/server.csv') as server_file:
-    servers = [server.lower() for server in server_file.read().splitlines()]
-with open('./consts/gateway.csv') as gate_file:
-    gates = [gate.lower() for gate in gate_file.read().splitlines()]
-with open('./consts/monitor.csv') as monitor_file:
-    monitors = [monitor.lower() for monitor in monitor_file.read().splitlines()]
-with open('./consts/discovery.csv') as disco_file:
-    discos = [disco.lower() for disco in disco_file.read().splitlines()]
-
-DATA = {
-    'dbs': dbs, 'servers': servers, 'buses': buses, 'langs': langs, 'gates': gates, 'monitors': monitors,
-    'discos': discos
-}
+import compose
+from dep_graph import DepGraph
+
+from git_backend import GitObjectSource, head, index_tree, pack_size, remote_heads, root_commits, top_trees, tree_id
+from heads import HeadOwners
+from languages import VERSION as LANGUAGES_VERSION, LanguageCache, count_languages, language_stats, main_languages, \
+    merge_counts, stats_of_counts
+from metadata import GitHubClient, MetadataCache, MetadataPrefetcher
+from parse_cache import ParseCache, blob_id, data_digest
+from profiling import RepoProfiler, timings
+from repo_index import INDEXED_FILES, index_repo
+from result_store import open_store
+from run_log import RunLog
+from scheduler import ORDERS, CloneScheduler
+from tech_index import TechIndex, load_data, tokenize
+
+DATA = load_data()
+TECH_INDEX = TechIndex(DATA)
+# pandas, git, tqdm, filelock, smtplib, the mirrors and the asyncio pipeline are imported by the functions using them:
+# the parsing processes import this module too and need none of them
+IMPORT_TIME = time.perf_counter() - _import_start
 
 LOG_FILES = {}
-def are_similar(name, candidate):
-    return name == candidate
+# run_log.RunLog writing the LOG_FILES, created with them
+RUN_LOG = None
+# metadata.MetadataPrefetcher of the run, when the sizes come from the batched and cached lookups
+METADATA = None
+# builtin: languages.py over the file index, linguist: github-linguist, check: both, differences are logged
+LANGUAGE_ENGINES = ['builtin', 'linguist', 'check']
+LANGUAGE_ENGINE = 'builtin'
+# languages.LanguageCache of the run, results by git tree id
+LANGUAGE_CACHE = None
+# repos with more files than this get their languages cached per top level directory too
+LARGE_REPO_FILES = 10000
+# profiling.RepoProfiler of the run, when some repos are profiled
+PROFILER = None
+# result_store.open_store of the run, the results/ directory by default
+RESULTS = None
+# rows of an input CSV read at a time
+CSV_CHUNK_SIZE = 10000
+# repos submitted and not finished per worker, when the window is not given
+IN_FLIGHT_PER_WORKER = 4
+# scheduler.CloneScheduler of the run, orders the repos and holds the clones back while the disk budget is full
+SCHEDULER = CloneScheduler()
+# repos bigger than this, in KB like the size of the GitHub API, are not cloned
+MAX_REPO_SIZE = 512000
+# expected bytes in temp/ of a repo without metadata, and per KB of the packed size of the others
+# (the packed objects plus the working tree)
+DEFAULT_CLONE_SIZE = 100 * 1024 * 1024
+CLONE_SIZE_FACTOR = {'worktree': 2 * 1024, 'odb': 1024}
+# mirrors.MirrorCache of the run, when the repos are fetched into kept mirrors and cloned from them
+MIRRORS = None
+# names of the repos analyzed again although they have a result, because the HEAD of their remote moved
+REFRESH = set()
+# parse_cache.ParseCache of the run and of every parsing process, analyses of the manifests by blob id
+PARSE_CACHE = None
+# heads.HeadOwners of the run, when the forks and mirrors are linked instead of analyzed
+HEAD_OWNERS = None
+
+def match_one(name, category):
+    return TECH_INDEX.match_one(name, category)
+
+
+def match_alls(names, category):
+    return TECH_INDEX.match_alls(names, category)
+
+
+def match_ones(names, category):
+    return TECH_INDEX.match_ones(names, category)
+
+
+# git clone arguments of every fetch strategy:
+# - full: complete clone with working tree
+# - blobless: only the blobs of HEAD are fetched (at checkout), history stays available for committers
+# - sparse: blobless clone with a sparse checkout of the files the analyzers read, the other blobs are never fetched
+# - shallow: sparse, and only the last commit (committers then counts the authors of HEAD only)
+# where analyze_repo reads the files from: a checked-out working tree, or the object database of a bare clone
+BACKENDS = ['worktree', 'odb']
+
+FETCH_STRATEGIES = {
+    'full': [],
+    'blobless': ['--filter=blob:none'],
+    'sparse': ['--filter=blob:none', '--no-checkout'],
+    'shallow': ['--filter=blob:none', '--no-checkout', '--depth', '1'],
+}
+
+
+def sparse_checkout(fetch, backend):
+    # the working tree only holds the manifests and the clone has no other blob, see clone_index
+    return backend == 'worktree' and '--no-checkout' in FETCH_STRATEGIES[fetch]
 
 
-def match_one(name, l):
-    for candidate in l:
-        if are_similar(name, candidate):
-            return [candidate]
-    return []
+def fetch_repo(repo_url, workdir, repo_name, strategy='full', bare=False):
+    args = FETCH_STRATEGIES[strategy]
+    if bare:
+        # the odb backend needs the size of every blob of HEAD, so only the depth of the strategy applies
+        args = ['--bare'] + (['--depth', '1'] if '--depth' in args else [])
+    import git
+    git.Git(workdir).clone(*args, repo_url, repo_name)
+    if '--no-checkout' in args:
+        repo = git.Git(path.join(workdir, repo_name))
+        # non-cone patterns match the manifests at any depth, the checkout fetches just their blobs
+        repo.sparse_checkout('set', '--no-cone', *INDEXED_FILES)
+        repo.checkout()
 
 
-def match_alls(names, l):
-    alls = set()
-    for name in names:
-        alls.update(match_one(name, l))
-    return list(alls)
+def repo_metadata(repo_url, full_repo_name):
+    if 'github.com' not in repo_url:
+        return {}
+    if METADATA is not None:
+        return METADATA.get(full_repo_name)
+    endpoint = 'https://api.github.com/repos/%s' % (full_repo_name,)
+    p1 = subprocess.run(['curl', endpoint], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,)
+    return json.loads(p1.stdout.decode("utf-8"))
 
 
-def match_ones(names, l):
-    for name in names:
-        res = match_one(name, l)
-        if res:
-            return res
-    return []
+def remote_url(repo_url):
+    # force SSH protocol
+    #repo_url = repo_url.replace("git://github.com/", "git@github.com:")
+    return repo_url.replace("https://github.com/", "git@github.com:")
 
 
-def clone(repo_url, full_repo_name, wlock):
+def clone(repo_url, full_repo_name, fetch='full', bare=False, metadata=None):
     #full_repo_name = full_repo_name.replace("_", "/")
     parts = full_repo_name.split('/')
     if len(parts) != 2:
@@ -86,24 +157,19 @@ def clone(repo_url, full_repo_name, wlock):
     full_workdir = path.join(workdir, repo_name)
     if not path.exists(full_workdir):
         #print('-cloning repo')
-        endpoint = 'https://api.github.com/repos/%s' % (full_repo_name,)
-        p1 = subprocess.run(['curl', endpoint], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,)
-        data = json.loads(p1.stdout.decode("utf-8"))
-        if 'size' not in data or data['size'] < 512000:
+        data = metadata if metadata is not None else repo_metadata(repo_url, full_repo_name)
+        if 'size' not in data or data['size'] < MAX_REPO_SIZE:
             try:
-                # force SSH protocol
-                #repo_url = repo_url.replace("git://github.com/", "git@github.com:")
-                repo_url = repo_url.replace("https://github.com/", "git@github.com:")
+                remote = remote_url(repo_url)
                 #print("--repo_url", repo_url)
-                git.Git(workdir).clone(repo_url)
+                if MIRRORS is not None:
+                    with MIRRORS.mirror(repo_url, remote) as mirror:
+                        fetch_repo(mirror, workdir, repo_name, fetch, bare)
+                else:
+                    fetch_repo(remote, workdir, repo_name, fetch, bare)
             except Exception:
-                with open(LOG_FILES['errors_on_cloning'], 'a') as f:
-                    f.write(repo_url + '\n')
-                with wlock:
-                    with open(LOG_FILES['num_errors'], 'r') as f:
-                        errors = int(f.read())
-                    with open(LOG_FILES['num_errors'], 'w') as f:
-                        f.write(str(errors + 1))
+                RUN_LOG.log('errors_on_cloning', url=remote)
+                RUN_LOG.count('num_errors')
                 return None
                 # print("cloning repo exception", e)
         else:
@@ -115,39 +181,62 @@ def clone(repo_url, full_repo_name, wlock):
     return full_workdir
 
 
-def locate_files(workdir, filename):
+def clone_path(full_repo_name):
+    parts = full_repo_name.split('/')
+    return path.join("temp", *parts) if len(parts) == 2 else None
+
+
+def remove_clone(full_repo_name):
+    """ Removes the clone of the repo """
+    workdir = clone_path(full_repo_name)
+    # the folder of the user stays: removing it once empty races with a clone of another repo of the user,
+    # the empty ones are removed by remove_user_folders at the end of the run
+    if workdir is not None:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def remove_user_folders():
+    """ Removes the folders of the users left empty in temp/ by remove_clone, once no clone runs """
+    for folder in Path('temp').iterdir():
+        if folder.is_dir():
+            try:
+                folder.rmdir()
+            except OSError:
+                pass
+
+
+def expected_size(repo_url, full_repo_name, backend='worktree', metadata=None):
+    """ bytes the clone of the repo is expected to take in temp/ """
+    if metadata is None and METADATA is not None and 'github.com' in repo_url:
+        metadata = METADATA.cache.get(full_repo_name)
+    if not metadata or 'size' not in metadata:
+        return DEFAULT_CLONE_SIZE
+    return metadata['size'] * CLONE_SIZE_FACTOR[backend]
+
+
+def locate_files(workdir, filename, index=None):
     # print('-locating ', filename)
-    res = []
-    try:
-        for df in Path(workdir).rglob(filename):
-            if not df.is_file():
-                continue
-            df = str(df)
-            res.append(df.split(workdir)[-1])
-    except OSError:
-        pass
-    return res
+    if index is None or filename not in index.files:
+        index = index_repo(workdir, [filename])
+    return index.locate(filename)
 
 
-def get_words(data, unique=False):
-    data = data.translate(str.maketrans(string.punctuation, ' ' * len(string.punctuation)))
-    data = data.translate(str.maketrans(string.digits, ' ' * len(string.digits)))
-    data = data.lower()
-    words = [w for w in nltk.word_tokenize(data) if len(w) > 2]
+def get_words(data, unique=False, min_len=3):
+    words = [w for w in tokenize(data) if len(w) >= min_len]
     if unique:
         words = set(words)
     return words
 
 
-def keywords(data, n=5):
-    words = get_words(data)
-    counter = Counter(words)
+def keywords(data, n=5, words=None):
+    if words is None:
+        words = get_words(data)
+    counter = Counter(w for w in words if len(w) > 2)
     most_commons = [x[0] for x in counter.most_common(n)]
     return most_commons
 
 
-def analyze_languages(workdir):
-    # print('-analyzing languages')
+def linguist_languages(workdir):
     result = subprocess.run(['github-linguist --json'], stdout=subprocess.PIPE, shell=True, cwd=workdir)
     output = result.stdout.decode("utf-8")
     dict_langs = json.loads(output)
@@ -155,11 +244,90 @@ def analyze_languages(workdir):
     return languages_list
 
 
-def analyze_dockerfile(workdir, df):
+def builtin_counts(workdir, index, cache=None):
+    if cache is None or index.num_files < LARGE_REPO_FILES:
+        return count_languages(index.entries)
+    # big repos are counted per top level directory, so a fork that only touched some of them
+    # reuses the counts of the others
+    trees = top_trees(git_dir(workdir))
+    parts = {}
+    for entry in index.entries:
+        top = entry[0].split('/', 2)[1] if entry[0].count('/') > 1 else None
+        parts.setdefault(top if top in trees else None, []).append(entry)
+    counts = []
+    for top, entries in parts.items():
+        if top is None:
+            counts.append(count_languages(entries))
+            continue
+        key = 'builtin:%d:%s:%s' % (LANGUAGES_VERSION, top, trees[top])
+        part = cache.get(key, subtree=True)
+        if part is None:
+            part = count_languages(entries)
+            cache.put(key, part)
+        counts.append(part)
+    return merge_counts(counts)
+
+
+def analyze_languages(workdir, index=None, cached=True, tree=None):
+    # print('-analyzing languages')
+    cache = LANGUAGE_CACHE if cached and LANGUAGE_ENGINE != 'check' else None
+    if cache is not None:
+        try:
+            key = '%s:%d:%s' % (LANGUAGE_ENGINE, LANGUAGES_VERSION, tree or tree_id(git_dir(workdir)))
+        except subprocess.CalledProcessError:
+            cache = None
+        else:
+            languages_list = cache.get(key)
+            if languages_list is not None:
+                return languages_list
+    if LANGUAGE_ENGINE == 'linguist':
+        languages_list = linguist_languages(workdir)
+    else:
+        if index is None:
+            index = index_repo(workdir, [])
+        languages_list = main_languages(stats_of_counts(builtin_counts(workdir, index, cache)))
+    if cache is not None:
+        cache.put(key, languages_list)
+    if LANGUAGE_ENGINE == 'check':
+        expected = linguist_languages(workdir)
+        if sorted(expected) != sorted(languages_list):
+            RUN_LOG.log('languages_mismatch', workdir=workdir, linguist=expected, builtin=languages_list)
+        return expected
+    return languages_list
+
+
+class MemorySource:
+    """ Files read ahead by a worker thread, shipped with the task to the analysis processes """
+
+    def __init__(self, contents):
+        self.contents = contents
+
+    def read(self, f):
+        return self.contents[f]
+
+
+def read_bytes(workdir, f, source=None):
+    if source is None:
+        with open(workdir + f, 'rb') as fl:
+            return fl.read()
+    return source.read(f)
+
+
+def read_text(workdir, f, source=None):
+    if source is None:
+        with open(workdir + f) as fl:
+            return fl.read()
+    return read_bytes(workdir, f, source).decode('utf-8')
+
+
+def analyze_dockerfile(workdir, df, source=None):
     # print('-analyzing dockerfile', df)
     analysis = {'path': df, 'cmd': '', 'cmd_keywords': [], 'from': ''}
     try:
-        commands = dockerfile.parse_file(workdir + df)
+        if source is None:
+            commands = dockerfile.parse_file(workdir + df)
+        else:
+            commands = dockerfile.parse_string(read_text(workdir, df, source))
         runs = ''
         for command in commands:
             if command.cmd.lower() == 'from' and command.value:
@@ -169,30 +337,36 @@ def analyze_dockerfile(workdir, df):
                 runs += '%s ' % (' '.join(command.value),)
             if command.cmd.lower() == 'cmd':
                 analysis['cmd'] = ' '.join(command.value)
-                analysis['cmd_keywords'] = keywords(analysis['cmd'])
-            analysis['keywords'] = keywords(runs)
+        # tokenize every text once, the words are shared by all the categories below
+        from_words = get_words(analysis['from'], min_len=1)
+        cmd_words = get_words(analysis['cmd'], min_len=1)
+        run_words = get_words(runs, min_len=1)
+        if analysis['cmd']:
+            analysis['cmd_keywords'] = keywords(analysis['cmd'], words=cmd_words)
+        if commands:
+            analysis['keywords'] = keywords(runs, words=run_words)
         if 'from' in analysis:
-            for k, v in DATA.items():
-                analysis[k] = match_one(analysis['from'], v) \
-                              or match_ones(get_words(analysis['from']), v) \
-                              or match_ones(get_words(analysis['cmd']), v) \
-                              or match_ones(get_words(runs), v)
+            for k in DATA:
+                analysis[k] = match_one(analysis['from'], k) \
+                              or match_ones(from_words, k) \
+                              or match_ones(cmd_words, k) \
+                              or match_ones(run_words, k)
     except dockerfile.GoParseError as e:
         pass
         # print(e)
     return analysis
 
 
-def analyze_file(workdir, f):
+def analyze_file(workdir, f, source=None):
     # print('-analyzing file', f)
     analysis = {'path': f}
     try:
-        with open(workdir + f) as fl:
-            data = ' '.join(fl.read().splitlines())
-            for k, v in DATA.items():
-                if k == 'langs':
-                    continue
-                analysis[k] = match_alls(get_words(data), v)
+        data = ' '.join(read_text(workdir, f, source).splitlines())
+        words = get_words(data, min_len=1)
+        for k in DATA:
+            if k == 'langs':
+                continue
+            analysis[k] = match_alls(words, k)
     except UnicodeDecodeError as e:
         pass
         # print(e)
@@ -207,9 +381,15 @@ def check_shared_db(analysis):
     return len(set(dependencies)) != len(dependencies)
 
 
+def git_dir(workdir):
+    # bare clones of the odb backend have no .git folder
+    dot_git = os.path.join(workdir, '.git')
+    return dot_git if path.exists(dot_git) else workdir
+
+
 def committers(workdir):
     try:
-        result = subprocess.run(['git', '--git-dir', os.path.join(workdir, '.git'), 'shortlog', '-s'],
+        result = subprocess.run(['git', '--git-dir', git_dir(workdir), 'shortlog', '-s', 'HEAD'],
                                 stdout=subprocess.PIPE, timeout=5)
         output = result.stdout.decode("utf-8")
         return len(output.splitlines())
@@ -217,97 +397,119 @@ def committers(workdir):
         return 0
 
 
-def analyze_docker_compose(workdir, dc):
+def empty_structure(files):
+    structure = {'path': files[0] if files else files, 'num_services': 0, 'services': [],
+                 'detected_dbs': {'num': 0, 'names': [], 'services': [], 'shared_dbs': False}}
+    if len(files) > 1:
+        structure['overrides'] = files[1:]
+    return structure
+
+
+def analyze_docker_compose(workdir, dc, source=None):
+    return analyze_stack(workdir, [dc], source)
+
+
+def analyze_stack(workdir, files, source=None):
+    """ structure of the compose files of a stack, merged in order like docker compose -f ... -f ... """
     # print('-analyzing docker-compose')
-    dep_graphs = {'full': nx.DiGraph(), 'micro': None}
-    nodes_not_microservice = []
-    analysis = {'path': dc, 'num_services': 0, 'services': [],
-                'detected_dbs': {'num': 0, 'names': [], 'services': [], 'shared_dbs': False}}
-    with open(workdir + dc) as f:
-        try:
-            data = yaml.load(f, Loader=yaml.FullLoader)
-            services = []
-            detected_dbs = []
-            if not data or 'services' not in data or not data['services']:
-                return analysis
-            for name, service in data['services'].items():
-                if not service:
+    analysis = empty_structure(files)
+    try:
+        data = compose.merge_files([compose.load(read_text(workdir, f, source)) for f in files])
+        if not data or 'services' not in data or not data['services']:
+            return analysis
+        services = []
+        for name, service in data['services'].items():
+            if not service:
+                continue
+            s = {}
+            s['name'] = name
+            if 'image' in service and service['image']:
+                s['image'] = service['image'].split(':')[0]
+                s['image_full'] = service['image']
+            elif 'build' in service and service['build']:
+                s['image'] = s['image_full'] = service['build']
+            else:
+                s['image'] = s['image_full'] = ''
+            if isinstance(s['image'], dict):
+                s['image'] = s['image_full'] = str(list(s['image'].values())[0])
+
+            image_words = get_words(s['image'], min_len=1)
+            for k in DATA:
+                if k == 'langs':
                     continue
-                s = {}
-                s['name'] = name
-                if 'image' in service and service['image']:
-                    s['image'] = service['image'].split(':')[0]
-                    s['image_full'] = service['image']
-                elif 'build' in service and service['build']:
-                    s['image'] = s['image_full'] = service['build']
-                else:
-                    s['image'] = s['image_full'] = ''
-                if isinstance(s['image'], dict):
-                    s['image'] = s['image_full'] = str(list(s['image'].values())[0])
-
-                for k, v in DATA.items():
-                    if k == 'langs':
-                        continue
-                    s[k] = match_ones(get_words(s['image']), v)
-
-                if s['dbs']:
-                    detected_dbs.append({'service': name, 'name': s['dbs'][0]})
-
-                if 'depends_on' in service:
-                    if isinstance(service['depends_on'], dict):
-                        s['depends_on'] = list(service['depends_on'].keys())
-                    else:
-                        s['depends_on'] = service['depends_on']
-                elif 'links' in service:
-                    s['depends_on'] = list(service['links'])
+                s[k] = match_ones(image_words, k)
+
+            if 'depends_on' in service:
+                if isinstance(service['depends_on'], dict):
+                    s['depends_on'] = list(service['depends_on'].keys())
                 else:
-                    s['depends_on'] = []
-
-                if s['depends_on'] is None:
-                    s['depends_on'] = []
-                services.append(s)
-
-                # add the node to the dependencies graph
-                dep_graphs['full'].add_node(name)
-                # add the edges to the dependencies graph
-                dep_graphs['full'].add_edges_from([(name, serv) for serv in s['depends_on']])
-                # append the node to the nodes_not_microservice list if the node is not a microservice
-                if s['dbs'] or s['servers'] or s['buses'] or s['gates'] or s['monitors'] or s['discos']:
-                    nodes_not_microservice.append(name)
-            analysis['services'] = services
-            analysis['num_services'] = len(services)
-            analysis['detected_dbs'] = {'num': len(detected_dbs), \
-                                        'names': list({db['name'] for db in detected_dbs}), \
-                                        'services': [db['service'] for db in detected_dbs]}
-            analysis['detected_dbs']['shared_dbs'] = check_shared_db(analysis)
-
-            # copy the full graph
-            dep_graphs['micro'] = dep_graphs['full'].copy()
-            # delete the not-microservice nodes from the micro dependencies graph
-            for node in nodes_not_microservice:
-                dep_graphs['micro'].remove_node(node)
-            for g in dep_graphs:
-                analysis['dep_graph_' + g] = {'nodes': dep_graphs[g].number_of_nodes(),
-                                              'edges': dep_graphs[g].number_of_edges(),
-                                              'avg_deps_per_service': sum(
-                                                  [out_deg for name, out_deg in dep_graphs[g].out_degree]) / dep_graphs[
-                                                                          g].number_of_nodes() if dep_graphs[
-                                                                                                      g].number_of_nodes() != 0 else 0,
-                                              'acyclic': nx.is_directed_acyclic_graph(dep_graphs[g]),
-                                              'longest_path': nx.dag_longest_path_length(dep_graphs[g])}
-
-        except (UnicodeDecodeError, yaml.parser.ParserError, yaml.scanner.ScannerError) as e:
-            pass
-            # print(e)
+                    s['depends_on'] = service['depends_on']
+            elif 'links' in service:
+                s['depends_on'] = list(service['links'])
+            else:
+                s['depends_on'] = []
+
+            if s['depends_on'] is None:
+                s['depends_on'] = []
+            services.append(s)
+        set_services(analysis, services)
+
+    except (UnicodeDecodeError, yaml.YAMLError) as e:
+        pass
+        # print(e)
 
     return analysis
 
 
-def compute_size(workdir):
+def set_services(analysis, services):
+    """ services, detected dbs and dependency graphs of a structure """
+    dep_graph = DepGraph()
+    nodes_not_microservice = []
+    detected_dbs = []
+    for s in services:
+        name = s['name']
+        if s['dbs']:
+            detected_dbs.append({'service': name, 'name': s['dbs'][0]})
+        # add the node and its edges to the dependencies graph
+        dep_graph.add_edges(name, s['depends_on'])
+        # append the node to the nodes_not_microservice list if the node is not a microservice
+        if s['dbs'] or s['servers'] or s['buses'] or s['gates'] or s['monitors'] or s['discos']:
+            nodes_not_microservice.append(name)
+    analysis['services'] = services
+    analysis['num_services'] = len(services)
+    analysis['detected_dbs'] = {'num': len(detected_dbs), \
+                                'names': list({db['name'] for db in detected_dbs}), \
+                                'services': [db['service'] for db in detected_dbs]}
+    analysis['detected_dbs']['shared_dbs'] = check_shared_db(analysis)
+
+    analysis['dep_graph_full'] = dep_graph.metrics()
+    # the micro graph is the full one without the not-microservice nodes
+    analysis['dep_graph_micro'] = dep_graph.metrics(dep_graph.without(nodes_not_microservice))
+
+
+def merge_stacks(stacks):
+    """ One structure for the default stacks of all the directories
+    With more than one, the names of the services are prefixed by the directory of their stack
+    """
+    if len(stacks) == 1:
+        return stacks[0]
+    merged = empty_structure([])
+    merged['path'] = [stack['path'] for stack in stacks]
+    services = []
+    for stack in stacks:
+        prefix = path.dirname(stack['path']).strip('/')
+        for service in stack['services']:
+            services.append(dict(service, name=path.join(prefix, str(service['name'])),
+                                 depends_on=[path.join(prefix, str(d)) for d in service['depends_on']]))
+    set_services(merged, services)
+    return merged
+
+
+def compute_size(workdir, index=None):
     try:
-        root_directory = Path(workdir)
-        return sum(
-            f.stat().st_size for f in root_directory.glob('**/*') if f.is_file() and '.git' not in f.parts) // 1000
+        if index is None:
+            index = index_repo(workdir, [])
+        return index.size // 1000
     except:
         return 0
 
@@ -354,57 +556,291 @@ def synthetize_data(analysis):
     analysis['avg_size_service'] = analysis['size'] / max(analysis['num_dockers'], 1)
 
 
-def analyze_repo(url, wlock, project_id=None):
+def open_parse_cache(cache_path, finalize=False):
+    """ opens PARSE_CACHE, also the initializer of the parsing processes """
+    global PARSE_CACHE
+    PARSE_CACHE = ParseCache(cache_path, data_digest(DATA))
+    if finalize:
+        # the processes of the pool are not told when they end
+        multiprocessing.util.Finalize(None, PARSE_CACHE.close, exitpriority=10)
+
+
+def file_id(workdir, f, source=None):
+    # the odb backend knows the blob ids, the files of a working tree are hashed like git does
+    index = getattr(source, 'index', None)
+    return index.blobs[f] if index is not None and f in index.blobs else blob_id(read_bytes(workdir, f, source))
+
+
+def parse_cached(kind, analyze, workdir, f, source, record):
+    """ analyze(workdir, f, source), from PARSE_CACHE when it has the blob; the hits are counted in record
+    f can also be the list of files of a compose stack, keyed by their blobs together
+    """
+    if PARSE_CACHE is None:
+        return analyze(workdir, f, source)
+    try:
+        if isinstance(f, str):
+            oid = file_id(workdir, f, source)
+        else:
+            oid = blob_id(' '.join(file_id(workdir, x, source) for x in f).encode())
+    except OSError:
+        return analyze(workdir, f, source)
+    # the same blobs can be found at other paths, the paths are not cached
+    paths = {'path': f} if isinstance(f, str) else {k: v for k, v in empty_structure(f).items()
+                                                    if k in ('path', 'overrides')}
+    cached = PARSE_CACHE.get(kind, oid)
+    if cached is not None:
+        record['cached'] = record.get('cached', 0) + 1
+        return dict(paths, **cached)
+    analysis = analyze(workdir, f, source)
+    PARSE_CACHE.put(kind, oid, {k: v for k, v in analysis.items() if k not in paths})
+    return analysis
+
+
+def analyze_manifests(workdir, analysis, manifests, source=None, stacks=None):
+    # CPU-bound part of the analysis: parsing and matching of the located files
+    # stacks: the structures of the compose stacks, when they were parsed on their own
+    t = timings(analysis)
+    with t.stage('dockers') as record:
+        dockers_analysis = []
+        for df in manifests['dockers']:
+            dockers_analysis.append(parse_cached('dockerfile', analyze_dockerfile, workdir, df, source, record))
+        analysis['dockers'] = dockers_analysis
+    with t.stage('compose') as record:
+        groups = compose.stacks(manifests['compose'])
+        if stacks is None:
+            stacks = [parse_cached('compose', analyze_stack, workdir, files, source, record) for files, _ in groups]
+        defaults = [stack for stack, (_, default) in zip(stacks, groups) if default]
+        analysis['structure'] = merge_stacks(defaults) if defaults else empty_structure([])
+        if len(stacks) > 1:
+            analysis['stacks'] = stacks
+
+    with t.stage('files') as record:
+        file_analysis = []
+        for f in manifests['files']:
+            file_analysis.append(parse_cached('file', analyze_file, workdir, f, source, record))
+        analysis['files'] = file_analysis
+        synthetize_data(analysis)
+    return analysis
+
+
+def locate_manifests(workdir, index):
+    fs = locate_files(workdir, 'requirements.txt', index)
+    fs += locate_files(workdir, '*.gradle', index)
+    fs += locate_files(workdir, 'pom.xml', index)
+    fs += locate_files(workdir, 'package.json', index)
+    # every compose file name of the index, once each
+    dcs = []
+    for pattern in compose.COMPOSE_FILES:
+        dcs += [f for f in locate_files(workdir, pattern, index) if f not in dcs]
+    return {'dockers': locate_files(workdir, 'Dockerfile', index),
+            'compose': dcs,
+            'files': fs}
+
+
+def manifest_bytes(index, manifests):
+    sizes = dict(index.entries)
+    return {'dockers': sum(sizes.get(f, 0) for f in manifests['dockers']),
+            'compose': sum(sizes.get(f, 0) for f in manifests['compose']),
+            'files': sum(sizes.get(f, 0) for f in manifests['files'])}
+
+
+def analyze_stack_task(workdir, files, source):
+    record = {}
+    return parse_cached('compose', analyze_stack, workdir, files, source, record), record.get('cached', 0)
+
+
+def count_parse_cache(analysis, manifests):
+    records = analysis.get('timings', {})
+    hits = sum(records.get(k, {}).get('cached', 0) for k in ('dockers', 'compose', 'files'))
+    RUN_LOG.count('parse_cache_hits', hits)
+    parsed = len(manifests['dockers']) + len(compose.stacks(manifests['compose'])) + len(manifests['files'])
+    RUN_LOG.count('parse_cache_misses', parsed - hits)
+
+
+def parse_manifests(workdir, analysis, manifests, source=None, cpu_executor=None):
+    if cpu_executor is None:
+        analyze_manifests(workdir, analysis, manifests, source)
+        if PARSE_CACHE is not None:
+            count_parse_cache(analysis, manifests)
+        return
+    # the thread does the reads, the parsing runs in a process so it does not hold the GIL of the workers
+    to_read = manifests['dockers'] + manifests['compose'] + manifests['files']
+    contents = MemorySource({f: read_bytes(workdir, f, source) for f in to_read})
+    groups = compose.stacks(manifests['compose'])
+    stacks = None
+    if len(groups) > 1:
+        with timings(analysis).stage('compose') as record:
+            # several stacks are parsed side by side, each in a process of the pool
+            futures = [cpu_executor.submit(analyze_stack_task, workdir, files, contents) for files, _ in groups]
+            stacks = []
+            for future in futures:
+                stack, hits = future.result()
+                stacks.append(stack)
+                if hits:
+                    record['cached'] = record.get('cached', 0) + hits
+    result = cpu_executor.submit(analyze_manifests, workdir, analysis, manifests, contents, stacks).result()
+    # the records of the stages still running here stay the ones of this process
+    records = analysis['timings'] if 'timings' in analysis else {}
+    records.update({k: v for k, v in result.pop('timings', {}).items() if k not in records})
+    analysis.update(result)
+    analysis['timings'] = records
+    if PARSE_CACHE is not None:
+        count_parse_cache(analysis, manifests)
+
+
+def clone_index(workdir, source=None, sparse=False):
+    """ one walk of the working tree, or one listing of the HEAD tree, serves every lookup of the analysis """
+    if source is not None:
+        return source.index
+    if not sparse:
+        return index_repo(workdir)
+    # the sizes of ls-tree -l would fetch every blob of the partial clone, one by one: only the paths are listed,
+    # the sizes are the ones of the manifests checked out
+    index = index_tree(git_dir(workdir), sizes=False)
+    sizes = {}
+    for rel_path in index.blobs:
+        try:
+            sizes[rel_path] = os.path.getsize(workdir + rel_path)
+        except OSError:
+            pass
+    index.entries = [(rel_path, sizes.get(rel_path, 0)) for rel_path, _ in index.entries]
+    index.size = sum(sizes.values())
+    return index
+
+
+def sparse_size(metadata):
+    # the size of the metadata, in KB like compute_size: the clone has the blobs of the manifests only
+    return (metadata or {}).get('size', 0)
+
+
+def sparse_languages(index):
+    """ languages of the paths of the tree, without the blobs every file weighs the same """
+    return main_languages(language_stats((rel_path, 1) for rel_path, _ in index.entries))
+
+
+def analyze_clone(workdir, analysis, source=None, cpu_executor=None, sparse=False, metadata=None):
+    t = timings(analysis)
+    with t.stage('committers'):
+        analysis['commiters'] = committers(workdir)
+    with t.stage('size') as record:
+        index = clone_index(workdir, source, sparse)
+        analysis['size'] = compute_size(workdir, index) if not sparse else sparse_size(metadata)
+        manifests = locate_manifests(workdir, index)
+        record['bytes'] = index.size
+    with t.stage('languages') as record:
+        if sparse:
+            analysis['languages'] = sparse_languages(index)
+        else:
+            analysis['languages'] = analyze_languages(workdir, index, True, analysis.get('tree'))
+        record['bytes'] = index.size
+    # print("Language analysis completed")
+    with t.stage('parse'):
+        parse_manifests(workdir, analysis, manifests, source, cpu_executor)
+        set_parse_bytes(analysis, index, manifests)
+
+
+def set_parse_bytes(analysis, index, manifests):
+    records = analysis['timings']
+    parsed = manifest_bytes(index, manifests)
+    for k, n in parsed.items():
+        if k in records:
+            records[k]['bytes'] = n
+    records['parse']['bytes'] = sum(parsed.values())
+
+
+def record_head(analysis, workdir):
+    """ the commit and the tree the result describes """
+    try:
+        analysis['commit'], analysis['tree'] = head(git_dir(workdir))
+        analysis['roots'] = root_commits(git_dir(workdir))
+    except subprocess.CalledProcessError:
+        # empty repository
+        analysis['commit'] = analysis['tree'] = None
+        analysis['roots'] = []
+
+
+def profile(name):
+    return PROFILER.profile(name) if PROFILER is not None else contextlib.nullcontext()
+
+
+def repo_name(url, project_id=None):
+    # analysis['name'] = url.split('.git')[0].split('git://github.com/')[-1]
+    # analysis['name'] = url.split("https://github.com/")[-1]
+    if project_id is None:
+        return url.split("https://github.com/")[-1]
+    return project_id
+
+
+def repo_lock(url, **kwargs):
+    from filelock import FileLock
     lockfile = "temp/%s.lock" % (''.join(get_words(url)),)
-    lock = FileLock(lockfile, timeout=0.01)
+    return FileLock(lockfile, timeout=0.01, **kwargs)
+
+
+def write_result(name, analysis):
+    RESULTS.put(name, remove_invalid_char(analysis))
+    if HEAD_OWNERS is not None and analysis.get('commit') and 'duplicate_of' not in analysis:
+        # the repos of the run with the same HEAD waited for this result
+        owner, waiting = HEAD_OWNERS.written(name, analysis['commit'])
+        for fork, repo_url, _ in waiting:
+            write_link(fork, repo_url, analysis['commit'], owner)
+
+
+def write_link(name, repo_url, commit, owner):
+    write_result(name, {'url': repo_url, 'name': name, 'commit': commit, 'duplicate_of': owner})
+    RUN_LOG.count('duplicates')
+
+
+def release_head(name):
+    """ (url, project id) of the repo to analyze in place of name, see HeadOwners.release """
+    return HEAD_OWNERS.release(name) if HEAD_OWNERS is not None else None
+
+
+def log_generic_error(url):
+    RUN_LOG.log('generic_error', url=url, traceback=traceback.format_exc())
+
+
+def analyze_repo(url, project_id=None, fetch='full', backend='worktree', cpu_executor=None):
+    """ Analyzes the repo, then the repos waiting for its HEAD in its place when it got no result for it """
+    repo = (url, project_id)
+    while repo is not None:
+        analyze_one(*repo, fetch, backend, cpu_executor)
+        repo = release_head(repo_name(*repo))
+
+
+def analyze_one(url, project_id=None, fetch='full', backend='worktree', cpu_executor=None):
+    lock = repo_lock(url)
     workdir = None
     try:
         with lock:
             analysis = {'url': url}
-            # analysis['name'] = url.split('.git')[0].split('git://github.com/')[-1]
-            # analysis['name'] = url.split("https://github.com/")[-1]
-            if project_id is None:
-                analysis['name'] = url.split("https://github.com/")[-1]
-            else:
-                analysis['name'] = project_id
+            analysis['name'] = repo_name(url, project_id)
             # print('analyzing', analysis['name'])
-            outfile = path.join('results', analysis['name'].replace('/', '#').replace('_', '#',1))
-            outfile = "%s.json" % (outfile,)
-            if not path.exists(outfile):
-                workdir = clone(url, analysis['name'], wlock)
-                if not workdir:
-                    return
-                analysis['commiters'] = committers(workdir)
-                analysis['size'] = compute_size(workdir)
-                analysis['languages'] = analyze_languages(workdir)
-                # print("Language analysis completed")
-                dfs = locate_files(workdir, 'Dockerfile')
-                dockers_analysis = []
-                for df in dfs:
-                    dockers_analysis.append(analyze_dockerfile(workdir, df))
-                analysis['dockers'] = dockers_analysis
-                dc = locate_files(workdir, 'docker-compose.yml')
-                analysis['structure'] = {'path': dc, 'num_services': 0, 'services': [],
-                                         'detected_dbs': {'num': 0, 'names': [], 'services': [], 'shared_dbs': False}}
-                if len(dc):
-                    dc = dc[0]
-                    analysis['structure'] = analyze_docker_compose(workdir, dc)
-
-                fs = locate_files(workdir, 'requirements.txt')
-                fs += locate_files(workdir, '*.gradle')
-                fs += locate_files(workdir, 'pom.xml')
-                fs += locate_files(workdir, 'package.json')
-
-                file_analysis = []
-                for f in fs:
-                    file_analysis.append(analyze_file(workdir, f))
-                analysis['files'] = file_analysis
-                synthetize_data(analysis)
-
-                with open(outfile, 'w', encoding='utf-8') as f:
-                    analysis = remove_invalid_char(analysis)
-                    json.dump(analysis, f, ensure_ascii=False, indent=4)
-                shutil.rmtree(path.dirname(workdir))
+            if analysis['name'] in REFRESH or not RESULTS.has(analysis['name']):
+                try:
+                    sparse = sparse_checkout(fetch, backend)
+                    metadata = None
+                    with profile(analysis['name']):
+                        with timings(analysis).stage('clone') as record:
+                            if sparse:
+                                # kept for the size, the clone has no blob to measure
+                                metadata = repo_metadata(url, analysis['name'])
+                            workdir = clone(url, analysis['name'], fetch, bare=backend == 'odb', metadata=metadata)
+                        if not workdir:
+                            return
+                        record['bytes'] = pack_size(git_dir(workdir))
+                        record_head(analysis, workdir)
+                        if backend == 'odb':
+                            with GitObjectSource(workdir) as source:
+                                analyze_clone(workdir, analysis, source, cpu_executor)
+                        else:
+                            analyze_clone(workdir, analysis, cpu_executor=cpu_executor, sparse=sparse,
+                                          metadata=metadata)
+
+                    write_result(analysis['name'], analysis)
+                finally:
+                    # also what a failed clone or analysis left behind
+                    remove_clone(analysis['name'])
             # else:
                 # print('skipped')
     # except Timeout:
@@ -415,13 +851,117 @@ def analyze_repo(url, wlock, project_id=None):
     #         f.write(str(e) + ";" + url + '\n')
     except Exception as e:
         # print('Error, continuing...', e)
-        with wlock:
-            with open(LOG_FILES["generic_error"], 'a') as f:
-                f.write(str(traceback.format_exc()) + ";" + url + '\n')
+        log_generic_error(url)
     # finally:
     #     # print(workdir)
 
 
+# default concurrency of every stage of the pipeline mode, the cpu-bound ones are sized on the cores
+PIPELINE_LIMITS = {
+    'metadata': 16, 'clone': 64, 'committers': 16, 'size': 8, 'languages': os.cpu_count() or 1,
+    'parse': os.cpu_count() or 1, 'write': 1
+}
+
+
+def pipeline_stages(fetch='full', backend='worktree', cpu_executor=None, limits=None, done=None):
+    """ The steps of analyze_repo as pipeline.Stage, every job is the dict made by start """
+    from pipeline import Stage
+    limits = dict(PIPELINE_LIMITS, **(limits or {}))
+    sparse = sparse_checkout(fetch, backend)
+
+    def finish(job):
+        if job['source'] is not None:
+            job['source'].close()
+        remove_clone(job['analysis']['name'])
+        SCHEDULER.release(job.get('reserved', 0))
+        job['lock'].release()
+        if done is not None:
+            done(job)
+
+    def stage(name, func):
+        def run(job):
+            try:
+                # the result is written by the last stage, so that one is not timed
+                with timings(job['analysis']).stage(name) if name != 'write' else contextlib.nullcontext():
+                    keep = func(job)
+            except Exception:
+                log_generic_error(job['url'])
+                keep = False
+            if not keep or name == 'write':
+                finish(job)
+                return None
+            return job
+        return Stage(name, run, limits[name])
+
+    def metadata(job):
+        name = job['analysis']['name']
+        if not path.exists(path.join('temp', name)):
+            job['metadata'] = repo_metadata(job['url'], name)
+        return True
+
+    def clone_repo(job):
+        # waits while the clones on disk fill the budget
+        reserved = expected_size(job['url'], job['analysis']['name'], backend, job.get('metadata'))
+        SCHEDULER.reserve(reserved)
+        job['reserved'] = reserved
+        job['workdir'] = clone(job['url'], job['analysis']['name'], fetch, bare=backend == 'odb',
+                               metadata=job.get('metadata'))
+        if job['workdir']:
+            job['analysis']['timings']['clone']['bytes'] = pack_size(git_dir(job['workdir']))
+            record_head(job['analysis'], job['workdir'])
+        return job['workdir']
+
+    def count_committers(job):
+        job['analysis']['commiters'] = committers(job['workdir'])
+        return True
+
+    def size(job):
+        if backend == 'odb':
+            job['source'] = GitObjectSource(job['workdir'])
+        job['index'] = clone_index(job['workdir'], job['source'], sparse)
+        job['analysis']['size'] = (compute_size(job['workdir'], job['index']) if not sparse
+                                   else sparse_size(job.get('metadata')))
+        job['manifests'] = locate_manifests(job['workdir'], job['index'])
+        job['analysis']['timings']['size']['bytes'] = job['index'].size
+        return True
+
+    def languages(job):
+        if sparse:
+            job['analysis']['languages'] = sparse_languages(job['index'])
+        else:
+            job['analysis']['languages'] = analyze_languages(job['workdir'], job['index'], True,
+                                                             job['analysis'].get('tree'))
+        job['analysis']['timings']['languages']['bytes'] = job['index'].size
+        return True
+
+    def parse(job):
+        parse_manifests(job['workdir'], job['analysis'], job['manifests'], job['source'], cpu_executor)
+        set_parse_bytes(job['analysis'], job['index'], job['manifests'])
+        return True
+
+    def write(job):
+        write_result(job['analysis']['name'], job['analysis'])
+        return True
+
+    return [stage('metadata', metadata), stage('clone', clone_repo), stage('committers', count_committers),
+            stage('size', size), stage('languages', languages), stage('parse', parse), stage('write', write)]
+
+
+def start_job(url, project_id=None):
+    # the same checks analyze_repo does before cloning, the lock is released by the last stage of the job
+    name = repo_name(url, project_id)
+    lock = repo_lock(url, thread_local=False)
+    try:
+        lock.acquire()
+    except Exception:
+        log_generic_error(url)
+        return None
+    if name not in REFRESH and RESULTS.has(name):
+        lock.release()
+        return None
+    return {'url': url, 'analysis': {'url': url, 'name': name}, 'lock': lock, 'workdir': None, 'source': None}
+
+
 def remove_invalid_char(d):
     if isinstance(d, str):
         return d.encode('utf-16', 'surrogatepass').decode('utf-16')
@@ -468,57 +1008,362 @@ def url(project_id):
         res = '/'.join( [ 'https:/', platform, chunks[1] ] )
     except IndexError:
         res = '/'.join(['https:/', platform ])
-        with open(LOG_FILES['probably_invalid_url'], 'a') as f:
-            f.write(f"{res},{project_id}" + '\n')
+        RUN_LOG.log('probably_invalid_url', url=res, project_id=project_id)
     if (len (chunks) > 2): res = '/' .join ( [res, '_'.join(chunks[2:])] )
     return res
 
-def analyze_all(max_workers=None, fix_errors=False, debug=False):
+def urls(project_ids):
+    """ url() of a whole column at once, with the pandas string functions """
+    project_ids = project_ids.astype(str)
+    if project_ids.empty:
+        return project_ids
+    chunks = project_ids.str.split("_", n=1, expand=True)
+    if chunks.shape[1] < 2:
+        chunks[1] = None
+    prefix, rest = chunks[0], chunks[1]
+    # split("_", 1) never gives more than two chunks, only sourceforge.net is ever mapped by URL_PREFIXES
+    platform = ('github.com/' + prefix).where(prefix != "sourceforge.net", URL_PREFIXES["sourceforge.net"])
+    res = 'https://' + platform + ('/' + rest).fillna('')
+    for project_id, invalid in zip(project_ids[rest.isna()], res[rest.isna()]):
+        RUN_LOG.log('probably_invalid_url', url=invalid, project_id=project_id)
+    return res
+
+
+def read_repos(sources, analyzed=(), chunksize=CSV_CHUNK_SIZE, limit=None):
+    """ (url, project id) batches of all the input files in turn, read chunksize rows at a time
+    limit: at most this many repos per file
+    """
+    import pandas as pd
+    analyzed = set(analyzed)
+    for source in sources:
+        n = 0
+        for data in pd.read_csv(source, sep=',', encoding='utf-8', chunksize=chunksize):
+            if "P.U.csv" in source:
+                data = data[~data['ProjectID'].isin(analyzed)]
+                data = data.assign(URL=urls(data['ProjectID']))
+            data = data[data['URL'].str.contains("github")]
+            if limit is not None:
+                data = data.head(limit - n)
+            n += len(data)
+            project_ids = data["ProjectID"] if "ProjectID" in data else [None] * len(data)
+            yield list(zip(data["URL"], project_ids))
+            if limit is not None and n >= limit:
+                break
+
+
+def stored_commits():
+    """ name -> (url, commit, name of the result linked to) of every stored result
+    the commit is None for the results written before the commits were, the name for the ones that are not links
+    """
+    return {name: (record.get('url'), record.get('commit'), record.get('duplicate_of'))
+            for name, record in RESULTS.records()}
+
+
+def analyzed_heads():
+    """ HeadOwners of the stored results that are not links """
+    return HeadOwners({record['commit']: name for name, record in RESULTS.records()
+                       if record.get('commit') and 'duplicate_of' not in record})
+
+
+def moved_target(target, commit, commits, heads):
+    """ whether the result a link points to describes another commit than the link, or is going to """
+    if target not in commits:
+        return True
+    url, target_commit, _ = commits[target]
+    # the remote of the target not answering keeps the link
+    return target_commit != commit or heads.get(remote_url(url), commit) != commit
+
+
+def stale_repos(batch, commits, heads):
+    """ The repos of batch without a result, whose remote HEAD is not the commit of their result, or whose link
+    points to a result that moved to another commit
+    The second and third ones are added to REFRESH; a repo whose remote does not answer keeps its result
+    """
+    stale = []
+    for repo_url, project_id in batch:
+        name = repo_name(repo_url, project_id)
+        if name in commits:
+            remote = remote_url(repo_url)
+            if remote not in heads:
+                RUN_LOG.count('ls_remote_failed')
+                continue
+            _, commit, target = commits[name]
+            moved = target is not None and moved_target(target, commit, commits, heads)
+            if heads[remote] == commit and not moved:
+                RUN_LOG.count('unchanged')
+                continue
+            RUN_LOG.count('refreshed' if heads[remote] != commit else 'relinked')
+            REFRESH.add(name)
+            if HEAD_OWNERS is not None:
+                HEAD_OWNERS.disown(name)
+                if moved and target in commits:
+                    # the target is analyzed again when it comes, its old commit is not its own any more
+                    HEAD_OWNERS.disown(target)
+        stale.append((repo_url, project_id))
+    return stale
+
+
+def link_duplicates(batch, heads):
+    """ The repos of batch to analyze: a repo whose remote HEAD is the commit of another result gets a link to that
+    result written instead. When a repo taken before it in the run claimed the commit, it waits for that result:
+    it is linked once the result is written, or analyzed when there is none, see HeadOwners
+    """
+    kept = []
+    for repo_url, project_id in batch:
+        name = repo_name(repo_url, project_id)
+        commit = heads.get(remote_url(repo_url))
+        # a result is never replaced by a link
+        if commit is None or (name not in REFRESH and RESULTS.has(name)):
+            kept.append((repo_url, project_id))
+            continue
+        owner = HEAD_OWNERS.claim(commit, name, repo_url, project_id)
+        if owner == name:
+            kept.append((repo_url, project_id))
+        elif owner is not None:
+            write_link(name, repo_url, commit, owner)
+    return kept
+
+
+def stream_repos(batches, sizes=False, commits=None):
+    """ sizes: the metadata of a batch is fetched before its repos go to the scheduler
+    commits: stored_commits(), the repos with a result are only analyzed again when their HEAD moved
+    """
+    for batch in batches:
+        if commits is not None or HEAD_OWNERS is not None:
+            # one git ls-remote per repo serves both checks
+            remotes = set()
+            for repo_url, project_id in batch:
+                name = repo_name(repo_url, project_id)
+                if HEAD_OWNERS is not None or name in commits:
+                    remotes.add(remote_url(repo_url))
+                # a link also holds while the repo it points to keeps its HEAD
+                target = commits[name][2] if commits is not None and name in commits else None
+                if target is not None and target in commits:
+                    remotes.add(remote_url(commits[target][0]))
+            heads = remote_heads(sorted(remotes))
+            if commits is not None:
+                batch = stale_repos(batch, commits, heads)
+            if HEAD_OWNERS is not None:
+                batch = link_duplicates(batch, heads)
+        if METADATA is not None:
+            # the sizes of the next repos are fetched in batches while the workers clone
+            prefetch_metadata(batch)
+            if sizes:
+                METADATA.join()
+        yield from batch
+
+
+def analyze_stream(repos, max_workers=None, fetch='full', backend='worktree', cpu_executor=None, window=None):
+    """ One pool for the whole run, fed from the repos iterator
+    Never more than window repos are submitted and not finished, and window more are read ahead,
+    for SCHEDULER to pick from; the rest of the input is not read yet
+    """
+    from tqdm import tqdm
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    window = window or max_workers * IN_FLIGHT_PER_WORKER
+    def analyze_repo_task(size, repo_url, project_id):
+        try:
+            analyze_repo(repo_url, project_id, fetch, backend, cpu_executor)
+        finally:
+            # before the future is done, the loop below sees the space free when it wakes up
+            SCHEDULER.release(size)
+
+    repos = iter(repos)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, tqdm() as progress:
+        in_flight = set()
+        # [expected size, picks waited, url, project id]
+        pending = []
+        while True:
+            # the next row is only read while there is room, pending never grows past window
+            while len(pending) < window:
+                repo = next(repos, None)
+                if repo is None:
+                    break
+                repo_url, project_id = repo
+                pending.append([expected_size(repo_url, repo_name(repo_url, project_id), backend), 0,
+                                repo_url, project_id])
+            if not pending and not in_flight:
+                break
+            while pending and len(in_flight) < window:
+                i = SCHEDULER.pick(pending, idle=not in_flight)
+                if i is None:
+                    break
+                size, _, repo_url, project_id = pending.pop(i)
+                future = executor.submit(analyze_repo_task, size, repo_url, project_id)
+                future.add_done_callback(lambda _: progress.update())
+                in_flight.add(future)
+            if in_flight:
+                _, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+
+
+def analyze_pipeline(repos, fetch='full', backend='worktree', cpu_executor=None, limits=None):
+    from pipeline import run as run_pipeline
+    from tqdm import tqdm
+    # the repos waiting for a HEAD whose job ended without a result, sent back to the feeder; None wakes it up
+    waiting = queue.Queue()
+    lock = threading.Lock()
+    in_flight = 0
+    with tqdm() as progress:
+        def start(repo):
+            nonlocal in_flight
+            while repo is not None:
+                job = start_job(*repo)
+                if job is not None:
+                    with lock:
+                        in_flight += 1
+                    return job
+                progress.update()
+                # the repos waiting for a HEAD claimed by a repo that is skipped
+                repo = release_head(repo_name(*repo))
+            return None
+
+        def sent_back():
+            repos = []
+            while True:
+                try:
+                    repo = waiting.get_nowait()
+                except queue.Empty:
+                    return repos
+                if repo is not None:
+                    repos.append(repo)
+
+        def jobs():
+            for repo in repos:
+                for repo in [repo] + sent_back():
+                    job = start(repo)
+                    if job is not None:
+                        yield job
+            # the end of the input: the jobs still running may send repos back until the last one is done
+            waiting.put(None)
+            while True:
+                repo = waiting.get()
+                if repo is None:
+                    with lock:
+                        if in_flight == 0 and waiting.empty():
+                            return
+                    continue
+                job = start(repo)
+                if job is not None:
+                    yield job
+
+        def done(job):
+            nonlocal in_flight
+            progress.update()
+            # a repo waiting for the HEAD the job got no result for goes through the stages in its place
+            fork = release_head(job['analysis']['name'])
+            with lock:
+                in_flight -= 1
+                if fork is not None:
+                    waiting.put(fork)
+                elif in_flight == 0:
+                    waiting.put(None)
+
+        stages = pipeline_stages(fetch, backend, cpu_executor, limits, done=done)
+        run_pipeline(jobs(), stages)
+
+
+def prefetch_metadata(batch):
+    names = (repo_name(repo_url, project_id) for repo_url, project_id in batch if 'github.com' in repo_url)
+    METADATA.prefetch(name for name in names if name in REFRESH or not RESULTS.has(name))
+
+
+def analyze_all(max_workers=None, fix_errors=False, debug=False, fetch='full', backend='worktree', processes=None,
+                pipeline_limits=None, metadata_cache=None, languages='builtin', language_cache=None,
+                results='results', profile_fraction=0.0, profile_threshold=None, window=None, disk_budget=None,
+                order='input', mirrors=None, mirrors_size=None, update=False, parse_cache=None, dedup=False):
+    global METADATA, LANGUAGE_ENGINE, LANGUAGE_CACHE, RESULTS, PROFILER, SCHEDULER, MIRRORS, PARSE_CACHE, HEAD_OWNERS
     content = ""
+    cpu_executor = None
+    LANGUAGE_ENGINE = languages
+    RESULTS = open_store(results)
+    # the repos refreshed by an earlier run of the process have their new result
+    REFRESH.clear()
+    SCHEDULER = CloneScheduler(disk_budget, order)
+    if profile_fraction or profile_threshold is not None:
+        PROFILER = RepoProfiler(profile_fraction, profile_threshold)
     try:
+        if language_cache is not None:
+            LANGUAGE_CACHE = LanguageCache(language_cache)
+        if parse_cache is not None:
+            open_parse_cache(parse_cache)
+        if mirrors is not None:
+            from mirrors import MirrorCache
+            MIRRORS = MirrorCache(mirrors, mirrors_size) if mirrors_size else MirrorCache(mirrors)
+        if metadata_cache is not None:
+            METADATA = MetadataPrefetcher(MetadataCache(metadata_cache),
+                                          GitHubClient(token=os.environ.get('GITHUB_TOKEN')))
+        if processes is not None and not debug:
+            # threads keep cloning and running git; parsing goes to one process per core.
+            # forkserver: the workers do not inherit the threads and the open pipes of this process.
+            # The server imports this module by name from the working directory, the workers are forked
+            # from it with yaml, dockerfile and the other imports already loaded
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload([path.splitext(path.basename(__file__))[0]])
+            cpu_executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes or os.cpu_count(),
+                                                                  mp_context=context,
+                                                                  initializer=open_parse_cache if parse_cache else None,
+                                                                  initargs=(parse_cache, True))
         repos = Path('repos').glob('*.csv')
         repos = sorted([str(x) for x in repos])
         os.makedirs('temp', exist_ok=True)
-        analyzed = os.listdir('results')
+        # the update mode checks the repos with a result instead of skipping them
+        analyzed = RESULTS.names() if not update else []
         if fix_errors:
             analyzed = [x.replace('https://github.com/', '').replace("#", "_", 1).replace(".json", "") for x in analyzed]
 
-        for source in repos:
-            data = pd.read_csv(source, sep=',', encoding='utf-8')
-            if "P.U.csv" in source:
-                data = data[~data['ProjectID'].isin(analyzed)]
-
-                # data['ProjectID'] = [x for x in data['ProjectID'] if x not in analyzed]
-                data['URL'] = data['ProjectID'].apply(lambda x: url(x))
-            data = data[data['URL'].str.contains("github")]
-            if debug:
-                data = data.head(10)
-                max_workers = 1
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                writer_lock = Lock()
-                if data.get("ProjectID", None) is None:
-                    _ = list(tqdm(executor.map(analyze_repo, data["URL"],
-                                               [writer_lock] * len(data["URL"])), total=len(data["URL"])))
-                else:
-                #data['ProjectID'] = data['ProjectID'].apply(lambda x: 'https://github.com/' + str(x).replace("_", "/", 1))
-                    _ = list(tqdm(executor.map(analyze_repo, data["URL"], [writer_lock]*len(data["ProjectID"]), data["ProjectID"]), total=len(data["ProjectID"])))
-                # for repo in data["ProjectID"]:
-                #     repo = "https://github.com/" + repo.replace("_", "/", 1)
-                #
-                #     _ = executor.submit(analyze_repo, repo, writer_lock)
-
+        if debug:
+            max_workers = 1
+        if dedup:
+            HEAD_OWNERS = analyzed_heads()
+        repos = stream_repos(read_repos(repos, analyzed, limit=10 if debug else None),
+                             sizes=disk_budget is not None or order != 'input',
+                             commits=stored_commits() if update else None)
+        if pipeline_limits is not None and not debug:
+            analyze_pipeline(repos, fetch, backend, cpu_executor, pipeline_limits)
+        else:
+            analyze_stream(repos, max_workers, fetch, backend, cpu_executor, window)
 
     except Exception as e:
-        number_of_analyzed_project = len(os.listdir('results'))
-        errors = open(LOG_FILES["num_errors"], 'r').read()
+        number_of_analyzed_project = len(RESULTS)
+        errors = RUN_LOG.counters.value('num_errors')
         content = f'Subject: MS DATASET\n\nTHE PROCESS IS INTERRUPTED DUE TO THE FOLLOWING ERROR:\n{e}\n{traceback.format_exc()}\n\t- Analyzed projects: {number_of_analyzed_project}\n\t- Missing projects: {412030 - number_of_analyzed_project - int(errors)}\n\t- Error projects: {int(errors)}'
-        with open(LOG_FILES["generic_error"], 'a') as f:
-            f.write(str(e) + '\n')
+        RUN_LOG.log('generic_error', error=str(e))
     else:
-        number_of_analyzed_project = len(os.listdir('results'))
+        number_of_analyzed_project = len(RESULTS)
         content = f"Subject: MS DATASET\n\nTHE PROCESS IS COMPLETED:\n\t- Analyzed project: {number_of_analyzed_project}"
 
     finally:
+        if cpu_executor is not None:
+            cpu_executor.shutdown()
+        if METADATA is not None:
+            METADATA.close()
+            METADATA = None
+        if LANGUAGE_CACHE is not None:
+            print(LANGUAGE_CACHE.report())
+            content += '\n\t- %s' % (LANGUAGE_CACHE.report(),)
+            LANGUAGE_CACHE.close()
+            LANGUAGE_CACHE = None
+        if PARSE_CACHE is not None:
+            counts = RUN_LOG.counters.snapshot()
+            hits, misses = counts.get('parse_cache_hits', 0), counts.get('parse_cache_misses', 0)
+            report = 'Parse cache: %d hits, %d misses (%.1f%% hit rate)' % (
+                hits, misses, hits * 100 / (hits + misses) if hits + misses else 0)
+            print(report)
+            content += '\n\t- %s' % (report,)
+            PARSE_CACHE.close()
+            PARSE_CACHE = None
+        HEAD_OWNERS = None
+        if MIRRORS is not None:
+            content += '\n\t- %s' % (MIRRORS.report(),)
+            MIRRORS.close()
+            MIRRORS = None
+        report = 'Import time: %.3fs' % (IMPORT_TIME,)
+        print(report)
+        content += '\n\t- %s' % (report,)
+        if path.isdir('temp'):
+            remove_user_folders()
+        RESULTS.close()
+        RUN_LOG.close()
 
         send_email_notification(content)
 
@@ -526,6 +1371,7 @@ def analyze_all(max_workers=None, fix_errors=False, debug=False):
 
 
 def send_email_notification(content):
+    import smtplib
 
     mail = smtplib.SMTP('smtp.gmail.com',587)
 
@@ -546,35 +1392,116 @@ def send_email_notification(content):
 
 
 def create_log_file():
+    global RUN_LOG
     date = str(datetime.datetime.now()).replace(":", "-").replace(" ", "-").split(".")[0]
     os.makedirs(f"logs/{date}", exist_ok=True)
-    LOG_FILES["generic_error"] = f"logs/{date}/generic_error.txt"
+    LOG_FILES["generic_error"] = f"logs/{date}/generic_error.jsonl"
     LOG_FILES["num_errors"] = f"logs/{date}/num_errors.txt"
-    LOG_FILES["probably_invalid_url"] = f"logs/{date}/probably_invalid_url.txt"
-    LOG_FILES["errors_on_cloning"] = f"logs/{date}/errors_on_cloning.txt"
+    LOG_FILES["counters"] = f"logs/{date}/counters.json"
+    LOG_FILES["probably_invalid_url"] = f"logs/{date}/probably_invalid_url.jsonl"
+    LOG_FILES["errors_on_cloning"] = f"logs/{date}/errors_on_cloning.jsonl"
+    LOG_FILES["languages_mismatch"] = f"logs/{date}/languages_mismatch.jsonl"
 
-    open(f"logs/{date}/generic_error.txt", "w")
+    open(f"logs/{date}/generic_error.jsonl", "w")
     with open(f"logs/{date}/num_errors.txt", "w") as f:
         f.write("0")
-    open(f"logs/{date}/probably_invalid_url.txt", "w")
-    open(f"logs/{date}/errors_on_cloning.txt", "w")
+    open(f"logs/{date}/probably_invalid_url.jsonl", "w")
+    open(f"logs/{date}/errors_on_cloning.jsonl", "w")
+    open(f"logs/{date}/languages_mismatch.jsonl", "w")
+    RUN_LOG = RunLog(LOG_FILES)
 
 
 def main(argv):
     fix_errors = False
     debug = False
     num_workers = None
+    fetch = 'full'
+    backend = 'worktree'
+    processes = None
+    pipeline_limits = None
+    metadata_cache = None
+    languages = 'builtin'
+    language_cache = None
+    results = 'results'
+    profile_fraction = 0.0
+    profile_threshold = None
+    window = None
+    disk_budget = None
+    order = 'input'
+    mirrors = None
+    mirrors_size = None
+    update = False
+    parse_cache = None
+    dedup = False
     if len(argv) > 1:
-        opts, args = getopt.getopt(argv,"fdw:")
+        opts, args = getopt.getopt(argv,"fdw:c:b:p:s:m:l:t:r:o:O:i:D:q:M:X:uP:F")
         for opt, arg in opts:
             if opt == '-f':
                 fix_errors = True
             if opt == '-d':
                 debug = True
+            if opt == '-u':
+                update = True
+            if opt == '-F':
+                dedup = True
             if opt == '-w':
                 num_workers = int(arg)
+            if opt == '-c':
+                if arg not in FETCH_STRATEGIES:
+                    sys.exit('unknown fetch strategy %s, use one of %s' % (arg, ', '.join(FETCH_STRATEGIES)))
+                fetch = arg
+            if opt == '-b':
+                if arg not in BACKENDS:
+                    sys.exit('unknown backend %s, use one of %s' % (arg, ', '.join(BACKENDS)))
+                backend = arg
+            if opt == '-p':
+                processes = int(arg)
+            if opt == '-s':
+                # e.g. -s clone=64,parse=8, or -s default
+                pipeline_limits = {}
+                for limit in arg.split(','):
+                    if '=' in limit:
+                        stage, n = limit.split('=')
+                        if stage not in PIPELINE_LIMITS:
+                            sys.exit('unknown stage %s, use one of %s' % (stage, ', '.join(PIPELINE_LIMITS)))
+                        pipeline_limits[stage] = int(n)
+            if opt == '-m':
+                metadata_cache = arg
+            if opt == '-l':
+                if arg not in LANGUAGE_ENGINES:
+                    sys.exit('unknown language engine %s, use one of %s' % (arg, ', '.join(LANGUAGE_ENGINES)))
+                languages = arg
+            if opt == '-t':
+                language_cache = arg
+            if opt == '-r':
+                results = arg
+            if opt == '-o':
+                profile_fraction = float(arg)
+            if opt == '-O':
+                profile_threshold = float(arg)
+            if opt == '-i':
+                window = int(arg)
+            if opt == '-D':
+                # in GB
+                disk_budget = int(float(arg) * 1024 ** 3)
+            if opt == '-q':
+                if arg not in ORDERS:
+                    sys.exit('unknown order %s, use one of %s' % (arg, ', '.join(ORDERS)))
+                order = arg
+            if opt == '-M':
+                mirrors = arg
+            if opt == '-P':
+                parse_cache = arg
+            if opt == '-X':
+                # in GB
+                mirrors_size = int(float(arg) * 1024 ** 3)
     create_log_file()
-    analyze_all(fix_errors=fix_errors, debug=debug, max_workers=num_workers)
+    analyze_all(fix_errors=fix_errors, debug=debug, max_workers=num_workers, fetch=fetch, backend=backend,
+                processes=processes, pipeline_limits=pipeline_limits, metadata_cache=metadata_cache,
+                languages=languages, language_cache=language_cache, results=results,
+                profile_fraction=profile_fraction, profile_threshold=profile_threshold, window=window,
+                disk_budget=disk_budget, order=order, mirrors=mirrors, mirrors_size=mirrors_size,
+                update=update, parse_cache=parse_cache, dedup=dedup)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
\ No newline at end of file
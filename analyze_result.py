@@ -1,4 +1,6 @@
-import json
+import concurrent.futures
+import multiprocessing
+import os
 from os import path
 from pathlib import Path
 from collections import Counter
@@ -14,94 +16,111 @@ import statistics as stats
 
 from itertools import combinations, product
 
+from result_aggregate import KEYS, SIZE_KEYS, cache_key, fold, init_worker, pending_targets, read_targets, read_units
+from result_store import PART_SIZE, open_store
+
 with open('./consts/colors.csv') as colors_files:
     COLORS = colors_files.read().splitlines()
 
-KEYS = [ 'dbs', 'servers', 'buses', 'langs', 'gates', 'monitors', 'discos', 'images']
-NONSIZE_KEYS = ['images']
-SIZE_KEYS = ["num_%s" % (k,) for k in KEYS if k not in NONSIZE_KEYS]
-SIZE_KEYS.append("num_files")
-SIZE_KEYS.append("num_dockers")
-SIZE_KEYS.append("num_services")
-SIZE_KEYS.append("num_ms")
-SIZE_KEYS.append("size")
-SIZE_KEYS.append("avg_size_service")
-SIZE_KEYS.append("commiters")
-SIZE_KEYS.append("shared_dbs")
-
 SIZES = {k: [] for k in SIZE_KEYS}
 
-CLEANER = {}
-
 
 DATA = {}
 DEP_GRAPHS = []
+# aggregate caches kept in temp/, one per combination of arguments, the ones used last
+AGGREGATE_CACHES = 4
 
 for key in KEYS:
     DATA[key] = [[], [], []]
-    CLEANER[key] = [[''], {}]
-
-CLEANER['langs'][0] += ['css', 'html', 'jupyternotebook', 'vue', 'dockerfile', 'scratch', 'bash', 'shell', 'makefile']
-CLEANER['langs'][1].update({'golang' : 'go', 'gcc' : 'c', 'cmake': 'c'})
-
-CLEANER['images'][0] += ['base']
-CLEANER['servers'][0] += ['mongoose', 'zookeeper']
-CLEANER['dbs'][0] += ['max', 'zookeeper', 'db']
-CLEANER['dbs'][1].update({'sql' : 'mysql'})
-
-CLEANER['monitors'][0] += ['monitoring']
-CLEANER['gates'][0] += ['gateway', 'loadbalancer', 'loadbalancing']
-
-#CLEANER['gates'][1].update({'gateway' : '(G) nginx', 'loadbalancer': '(G) zuul', 'loadbalancing': ' (G) kong'}
-CLEANER['gates'][1].update({'nginx' : ' nginx (G)', 'zuul': 'zuul (G)', 'kong' : 'kong (G)', 'linkerd' : 'linkerd (G)'})
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-f", dest='filter_file', type=str, help="Filter file", required=False)
 parser.add_argument("-s", dest='min_services', type=int, help="Min services", default=0)
+parser.add_argument("-r", dest='results', type=str, help="Result store (results directory, sqlite:<file> or jsonl:<directory>)", default='results')
+parser.add_argument("-d", dest='duplicates', choices=['include', 'exclude'], help="Forks and mirrors linked to the result of the same HEAD", default='include')
+parser.add_argument("-p", dest='processes', type=int, help="Processes reading the results (default: one per core)", default=None)
 args = parser.parse_args()
 
-def clean_data(data):
-    for key in KEYS:
-        data[key] = set(data[key]) - set(CLEANER[key][0])
-        syn = CLEANER[key][1]
-        data[key] = [syn[x] if x in syn else x for x in data[key]]
-
-    data['num_ms'] = max(2, data['num_services']-data['num_dbs']-data['num_buses']-data['num_discos']-data['num_monitors']-data['num_gates'])
-
-def analyze_data(data):
-    global DATA, KEYS
-    clean_data(data)
-    if data['num_dockers'] > 30:
-        return False
-    # discard repos with microservices < args.min_services
-    num_ms = data['num_ms']
-    if num_ms < args.min_services:
-         return False
-    for key in KEYS:
-        DATA[key][0] += data[key]
-        if data[key]:
-            DATA[key][1].append(tuple(sorted(data[key])))
-        DATA[key][2].append(tuple(sorted(data[key])))
-
-    for key in SIZE_KEYS:
-        SIZES[key].append(data[key])
-
-    # save the dependencies graphs
-    if data['structure']:
-        DEP_GRAPHS.append({'full': data['structure']['dep_graph_full'],
-                           'micro': data['structure']['dep_graph_micro']})
-    return True
+def aggregate_store(include):
+    """ Aggregate of the results of the store
+    What every unit of the store (a result file, a range of rows, a segment) adds is cached in temp/, by the
+    arguments it depends on and with the stamp of the unit: only the new and changed units are read, in parts
+    split across a pool of processes, and the units no longer in the store are dropped from the cache. The results
+    out of the include set are read again afterwards, in this process, when a duplicate is linked to them
+    """
+    store = open_store(args.results)
+    cache_path = 'temp/aggregate-%s.pickle' % (cache_key(args.results, include, args.min_services, args.duplicates),)
+    cached = {}
+    if path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+    units = store.units()
+    read = {key: cached[key][1] for key, stamp, _, _ in units if key in cached and cached[key][0] == stamp}
+    tasks = []
+    task, n = [], 0
+    for key, _, part, records in units:
+        if key in read:
+            continue
+        task.append((key, part))
+        n += records
+        if n >= PART_SIZE:
+            tasks.append(task)
+            task, n = [], 0
+    if task:
+        tasks.append(task)
+    print("CACHED", len(read), "UNITS, READING", len(units) - len(read))
+
+    initargs = (args.results, include, args.min_services, args.duplicates)
+    processes = args.processes or os.cpu_count()
+    if processes == 1 or len(tasks) <= 1:
+        init_worker(*initargs)
+        pool = None
+        run = map
+    else:
+        # fork: the workers get the include set without pickling it, and this script has no main guard
+        # that would keep a spawned worker from running it again
+        pool = concurrent.futures.ProcessPoolExecutor(min(processes, len(tasks)),
+                                                      mp_context=multiprocessing.get_context('fork'),
+                                                      initializer=init_worker, initargs=initargs)
+        run = pool.map
+    try:
+        for units_read in run(read_units, tasks):
+            read.update(units_read)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    pending = pending_targets([(key, read[key]) for key, _, _, _ in units])
+    if pending:
+        init_worker(*initargs)
+        for key, _, part, _ in units:
+            if key in pending:
+                read[key] = read_targets(part, pending[key], read[key])
+
+    if tasks or pending or len(cached) != len(units):
+        os.makedirs('temp', exist_ok=True)
+        with open(cache_path + '.tmp', 'wb') as f:
+            pickle.dump({key: (stamp, read[key]) for key, stamp, _, _ in units}, f)
+        os.replace(cache_path + '.tmp', cache_path)
+        print('writed on disk')
+    elif path.exists(cache_path):
+        # the modification time is the last use, for prune_caches
+        os.utime(cache_path)
+    prune_caches()
+    return fold([read[key] for key, _, _, _ in units])
+
+
+def prune_caches(keep=AGGREGATE_CACHES):
+    """ Removes the aggregate caches but the keep used last, and the pickles of the old single cache """
+    caches = sorted(Path('temp').glob('aggregate-*.pickle'), key=lambda x: x.stat().st_mtime, reverse=True)
+    for stale in caches[keep:] + [Path('temp/SIZES'), Path('temp/DATA')]:
+        try:
+            stale.unlink()
+        except OSError:
+            pass
+
 
 def analyze_all():
-    global DATA, SIZES
-    if path.exists('temp/SIZES') and path.exists('temp/DATA'):
-        print('retriving from disk')
-        with open('temp/SIZES', 'rb') as f:
-            SIZES = pickle.load(f)
-        with open('temp/DATA', 'rb') as f:
-            DATA = pickle.load(f)
-        return
-    
+    global DATA, SIZES, DEP_GRAPHS
     include = set()
     if args.filter_file != None:
         with open(args.filter_file, newline='') as f:
@@ -132,26 +151,12 @@ def analyze_all():
 
     print("INCLUDING", len(include), " REPOS")
     
-    repos = Path('results').glob('*.json')
-    i = j = l = 0
-    for source in repos:
-        j += 1
-        try:
-            with open(str(source)) as json_file:
-                data = json.load(json_file)
-                if data['url'] and data['url'] in include:
-                    if analyze_data(data):
-                        l += 1
-                
-        except (UnicodeDecodeError, json.decoder.JSONDecodeError):
-            i += 1
-            pass
+    total = aggregate_store(include)
+    DATA, SIZES, DEP_GRAPHS = total.data, total.sizes, total.dep_graphs
+    i = total.errors
+    j = total.total + i
+    l = total.analyzed
 
-    with open('temp/SIZES', 'wb') as f:
-        pickle.dump(SIZES, f)
-    with open('temp/DATA', 'wb') as f:
-        pickle.dump(DATA, f)
-    print('writed on disk')
     print("TOTAL", j, "ANALYZED", l, "ERRORS", i)
     print("DATA len", len(DATA))
     print("DEP_GRAPHS len", len(DEP_GRAPHS))
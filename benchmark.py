@@ -0,0 +1,232 @@
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+
+import analyze_repo_multi_trhead as analyzer
+
+# shape of the synthetic repository, every key can be changed from the command line
+DEFAULT_SHAPE = {
+    'dockerfiles': 20, 'services': 30, 'edges': 60, 'dependencies': 300,
+    'depth': 5, 'fanout': 3, 'files_per_dir': 4, 'file_size': 2000, 'seed': 0
+}
+# a run of a benchmark repeats the call until it lasts at least this, in seconds
+MIN_RUN_TIME = 0.2
+# relative slowdown of the median over the baseline reported as a regression
+TOLERANCE = 0.1
+# the import benchmark runs from there, where the analyzer is importable
+ANALYZER_DIR = path.dirname(path.abspath(analyzer.__file__))
+
+
+def directories(shape):
+    """ relative paths of a tree `depth` levels deep with `fanout` subdirectories each """
+    dirs = ['']
+    level = ['']
+    for depth in range(shape['depth']):
+        level = ['%s/d%d_%d' % (parent, depth, i) for parent in level for i in range(shape['fanout'])]
+        dirs += level
+    return dirs
+
+
+def tech_names(rng, category, n):
+    names = [x for x in analyzer.DATA[category] if x and ' ' not in x]
+    return [rng.choice(names) for _ in range(n)]
+
+
+def dockerfile(rng, shape):
+    image = rng.choice(tech_names(rng, 'dbs', 3) + tech_names(rng, 'langs', 3) + ['openjdk', 'node', 'alpine'])
+    tools = ' '.join(tech_names(rng, 'servers', 3) + tech_names(rng, 'buses', 2) + tech_names(rng, 'monitors', 2))
+    lines = ['FROM %s:latest' % (image,), 'ENV APP_HOME=/opt/app', 'WORKDIR /opt/app',
+             'RUN apt-get update && apt-get install -y %s' % (tools,),
+             'COPY . /opt/app', 'RUN ./build.sh --with %s' % (' '.join(tech_names(rng, 'dbs', 2)),),
+             'EXPOSE %d' % (rng.randint(1024, 65535),), 'CMD ["java", "-jar", "app.jar"]']
+    return '\n'.join(lines) + '\n'
+
+
+def compose(rng, shape):
+    n = shape['services']
+    images = tech_names(rng, 'dbs', 4) + tech_names(rng, 'buses', 2) + tech_names(rng, 'gates', 1) + \
+        tech_names(rng, 'discos', 1) + tech_names(rng, 'monitors', 1)
+    deps = {i: set() for i in range(n)}
+    for _ in range(shape['edges'] if n > 1 else 0):
+        # a service only depends on the ones before it, docker compose refuses cycles
+        b, a = sorted(rng.sample(range(n), 2))
+        deps[a].add(b)
+    lines = ['version: "3"', 'services:']
+    for i in range(n):
+        lines.append('  svc%d:' % (i,))
+        if i < len(images):
+            lines.append('    image: %s:latest' % (images[i],))
+        else:
+            lines.append('    build: ./svc%d' % (i,))
+        if deps[i]:
+            lines.append('    depends_on:')
+            lines += ['      - svc%d' % (j,) for j in sorted(deps[i])]
+    return '\n'.join(lines) + '\n'
+
+
+def pom(rng, shape):
+    deps = ''.join('<dependency><groupId>org.%s</groupId><artifactId>%s-client</artifactId>'
+                   '<version>1.%d</version></dependency>\n' % (name, name, i)
+                   for i, name in enumerate(tech_names(rng, 'dbs', shape['dependencies'] // 2) +
+                                            tech_names(rng, 'buses', shape['dependencies'] // 2)))
+    return '<project><modelVersion>4.0.0</modelVersion><dependencies>\n%s</dependencies></project>\n' % (deps,)
+
+
+def package_json(rng, shape):
+    names = tech_names(rng, 'servers', shape['dependencies'] // 2) + tech_names(rng, 'dbs', shape['dependencies'] // 2)
+    return json.dumps({'name': 'bench', 'dependencies': {'%s-%d' % (name, i): '^1.0.%d' % (i,)
+                                                         for i, name in enumerate(names)}}, indent=2)
+
+
+def generate_repo(root, shape=DEFAULT_SHAPE):
+    """ Writes a synthetic repository under root, same seed same repository """
+    rng = random.Random(shape['seed'])
+    dirs = directories(shape)
+    filler = ('lorem ipsum %s ' % (' '.join(tech_names(rng, 'langs', 5)),) * shape['file_size'])[:shape['file_size']]
+    for d in dirs:
+        os.makedirs(root + d, exist_ok=True)
+        for i in range(shape['files_per_dir']):
+            with open('%s%s/file%d.%s' % (root, d, i, rng.choice(['java', 'py', 'js', 'go', 'txt'])), 'w') as f:
+                f.write(filler)
+    for d in rng.sample(dirs, min(shape['dockerfiles'], len(dirs))):
+        with open(root + d + '/Dockerfile', 'w') as f:
+            f.write(dockerfile(rng, shape))
+    with open(root + '/docker-compose.yml', 'w') as f:
+        f.write(compose(rng, shape))
+    with open(root + '/pom.xml', 'w') as f:
+        f.write(pom(rng, shape))
+    with open(root + '/package.json', 'w') as f:
+        f.write(package_json(rng, shape))
+    with open(root + '/requirements.txt', 'w') as f:
+        f.write(''.join('%s==1.0\n' % (name,) for name in tech_names(rng, 'dbs', 20)))
+    with open(root + dirs[-1] + '/build.gradle', 'w') as f:
+        f.write(''.join("implementation 'org.%s:%s:1.0'\n" % (name, name) for name in tech_names(rng, 'buses', 40)))
+
+
+def time_calls(func, number, setup=None):
+    # the arguments made by setup are built before the clock starts
+    args = [setup() for _ in range(number)] if setup is not None else None
+    start = time.perf_counter()
+    if args is None:
+        for _ in range(number):
+            func()
+    else:
+        for arg in args:
+            func(arg)
+    return time.perf_counter() - start
+
+
+def bench(func, repeat=5, setup=None, min_time=MIN_RUN_TIME):
+    """ seconds per call: min, median and mean of `repeat` runs """
+    number = 1
+    while True:
+        elapsed = time_calls(func, number, setup)
+        if elapsed >= min_time:
+            break
+        number = number * 10 if elapsed <= 0 else max(number + 1, int(number * min_time * 1.2 / elapsed))
+    times = [time_calls(func, number, setup) / number for _ in range(repeat)]
+    return {'number': number, 'repeat': repeat, 'min': min(times), 'median': statistics.median(times),
+            'mean': statistics.mean(times)}
+
+
+def benchmarks(workdir):
+    """ name -> (func, setup) of every benchmarked step, on the repository in workdir """
+    manifests = analyzer.locate_manifests(workdir, analyzer.index_repo(workdir))
+    with open(workdir + '/pom.xml') as f:
+        text = f.read()
+    words = analyzer.get_words(text, min_len=1)
+    analysis = {'url': 'bench', 'name': 'bench/bench', 'languages': ['java'],
+                'size': analyzer.compute_size(workdir)}
+    analyzer.analyze_manifests(workdir, analysis, manifests)
+    parsed = {k: analysis[k] for k in ('url', 'name', 'languages', 'size', 'dockers', 'structure', 'files')}
+    return {
+        'locate_files': (lambda: analyzer.locate_files(workdir, 'Dockerfile'), None),
+        'compute_size': (lambda: analyzer.compute_size(workdir), None),
+        'get_words': (lambda: analyzer.get_words(text), None),
+        'match_alls': (lambda: analyzer.match_alls(words, 'dbs'), None),
+        'analyze_dockerfile': (lambda: [analyzer.analyze_dockerfile(workdir, df) for df in manifests['dockers']],
+                               None),
+        'analyze_docker_compose': (lambda: analyzer.analyze_docker_compose(workdir, manifests['compose'][0]), None),
+        'analyze_file': (lambda: [analyzer.analyze_file(workdir, f) for f in manifests['files']], None),
+        'synthetize_data': (analyzer.synthetize_data, lambda: copy.deepcopy(parsed)),
+        # a new interpreter importing the analyzer, as every run and every parsing process does
+        'import': (lambda: subprocess.run([sys.executable, '-c', 'import analyze_repo_multi_trhead'],
+                                          cwd=ANALYZER_DIR, check=True), None),
+    }
+
+
+def run(shape=DEFAULT_SHAPE, repeat=5, only=None, keep=None):
+    root = keep or tempfile.mkdtemp(prefix='bench-')
+    try:
+        if not path.exists(root + '/docker-compose.yml'):
+            generate_repo(root, shape)
+        results = {}
+        for name, (func, setup) in benchmarks(root).items():
+            if only and name not in only:
+                continue
+            results[name] = bench(func, repeat, setup)
+        return {'python': platform.python_version(), 'machine': platform.machine(), 'shape': shape,
+                'results': results}
+    finally:
+        if keep is None:
+            shutil.rmtree(root)
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """ prints the medians against the baseline, returns the names of the regressions """
+    regressions = []
+    if baseline['shape'] != report['shape']:
+        print('warning: the baseline was taken on a repository of another shape')
+    for name, result in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        ratio = result['median'] / baseline['results'][name]['median']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = 'REGRESSION'
+        elif ratio < 1 - tolerance:
+            flag = 'faster'
+        print('%-24s %12.6f %12.6f %7.2fx %s' % (name, baseline['results'][name]['median'], result['median'],
+                                                 ratio, flag))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the analysis steps on a synthetic repository')
+    for key, value in DEFAULT_SHAPE.items():
+        parser.add_argument('--' + key.replace('_', '-'), dest=key, type=int, default=value)
+    parser.add_argument('-r', dest='repeat', type=int, default=5, help='runs per benchmark')
+    parser.add_argument('-o', dest='out', type=str, help='write the results to this JSON file')
+    parser.add_argument('-b', dest='baseline', type=str, help='compare with the results saved in this JSON file')
+    parser.add_argument('-t', dest='tolerance', type=float, default=TOLERANCE, help='slowdown reported as regression')
+    parser.add_argument('-k', dest='keep', type=str, help='generate the repository here and keep it')
+    parser.add_argument('benchmarks', nargs='*', help='only these benchmarks')
+    args = parser.parse_args(argv)
+    shape = {key: getattr(args, key) for key in DEFAULT_SHAPE}
+
+    report = run(shape, args.repeat, set(args.benchmarks), args.keep)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
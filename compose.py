@@ -0,0 +1,118 @@
+from fnmatch import fnmatchcase
+from os import path
+
+import yaml
+
+# file names docker compose looks for in a directory, the first one found is the one it uses
+BASE_FILES = ['compose.yaml', 'compose.yml', 'docker-compose.yaml', 'docker-compose.yml']
+# merged over the base file when no -f is given
+OVERRIDE_FILES = ['compose.override.yaml', 'compose.override.yml',
+                  'docker-compose.override.yaml', 'docker-compose.override.yml']
+# other files given with -f after the base one, e.g. docker-compose.prod.yml
+VARIANT_FILES = ['compose.*.yaml', 'compose.*.yml', 'docker-compose.*.yaml', 'docker-compose.*.yml']
+COMPOSE_FILES = BASE_FILES + VARIANT_FILES
+
+# sequences an override replaces instead of extending, as docker compose merges them
+REPLACED = {'command', 'entrypoint', 'test'}
+
+
+class _Override:
+    """ value tagged !override, it replaces the one of the base file instead of being merged """
+
+    def __init__(self, value):
+        self.value = value
+
+
+# value tagged !reset, the key is removed from the merged file
+_RESET = object()
+
+try:
+    _BaseLoader = yaml.CSafeLoader
+except AttributeError:
+    # PyYAML built without libyaml
+    _BaseLoader = yaml.SafeLoader
+
+
+class Loader(_BaseLoader):
+    pass
+
+
+def _construct(loader, node):
+    if isinstance(node, yaml.MappingNode):
+        return loader.construct_mapping(node, deep=True)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+    return loader.construct_scalar(node)
+
+
+Loader.add_constructor('!reset', lambda loader, node: _RESET)
+Loader.add_constructor('!override', lambda loader, node: _Override(_construct(loader, node)))
+
+
+def load(text):
+    return yaml.load(text, Loader=Loader)
+
+
+def merge(base, override, key=None):
+    """ override merged over base: mappings key by key, sequences extended, anything else replaced """
+    if isinstance(override, _Override):
+        return override.value
+    if key == 'depends_on' and isinstance(base, dict) != isinstance(override, dict):
+        # the short list form is the long form with the default condition
+        base, override = [x if isinstance(x, dict) else {name: {} for name in x or []} for x in (base, override)]
+    if isinstance(base, dict) and isinstance(override, dict):
+        merged = dict(base)
+        for k, v in override.items():
+            merged[k] = merge(base[k], v, k) if k in base else v
+        return merged
+    if isinstance(base, list) and isinstance(override, list) and key not in REPLACED:
+        return base + [x for x in override if x not in base]
+    return override
+
+
+def _clean(data):
+    if isinstance(data, _Override):
+        return _clean(data.value)
+    if isinstance(data, dict):
+        return {k: _clean(v) for k, v in data.items() if v is not _RESET}
+    if isinstance(data, list):
+        return [_clean(x) for x in data if x is not _RESET]
+    return data
+
+
+def merge_files(documents):
+    """ the documents of the files of a stack, in -f order, merged into one """
+    merged = None
+    for document in documents:
+        if not isinstance(document, dict):
+            continue
+        merged = document if merged is None else merge(merged, document)
+    return _clean(merged)
+
+
+def variant_priority(name):
+    # the order of VARIANT_FILES, then the name
+    return next(i for i, p in enumerate(VARIANT_FILES) if fnmatchcase(name, p)), name
+
+
+def stacks(paths):
+    """ (files, default) of every stack in the compose files found
+    Per directory: the base file with its override, the stack docker compose runs there by default,
+    then the base file with each of the variants. A directory without a base file has a stack per file,
+    the default one is the override, or the first variant by variant_priority
+    """
+    by_dir = {}
+    for p in paths:
+        by_dir.setdefault(path.dirname(p), []).append(path.basename(p))
+    result = []
+    for directory, names in by_dir.items():
+        base = [next(n for n in BASE_FILES if n in names)] if any(n in BASE_FILES for n in names) else []
+        overrides = [n for n in OVERRIDE_FILES if n in names]
+        variants = sorted((n for n in names if n not in BASE_FILES and n not in OVERRIDE_FILES), key=variant_priority)
+        if base:
+            files = [base + overrides[:1]] + [base + [v] for v in variants]
+        else:
+            files = [[n] for n in overrides + variants]
+        for i, names in enumerate(files):
+            result.append(([path.join(directory, n) for n in names], i == 0))
+    return result
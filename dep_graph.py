@@ -0,0 +1,134 @@
+class DepGraph:
+    """ Dependency graph of the services of a compose file, as adjacency arrays over integer ids
+    The metrics of a subgraph (the micro view) are computed on a mask of the nodes, the graph is not copied.
+    Cycles are handled by condensing the strongly connected components, the longest path is the one
+    of the condensation: on an acyclic graph it is the longest path of the graph
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.succ = []
+
+    def add_node(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.succ)
+            self.succ.append([])
+        return i
+
+    def add_edges(self, source, targets):
+        """ edges from source to each of the targets, the nodes are added when missing """
+        s = self.add_node(source)
+        seen = set(self.succ[s])
+        for target in targets:
+            t = self.add_node(target)
+            if t not in seen:
+                seen.add(t)
+                self.succ[s].append(t)
+
+    def without(self, names):
+        """ mask of the nodes of the graph but the ones in names """
+        keep = [True] * len(self.succ)
+        for name in names:
+            keep[self.ids[name]] = False
+        return keep
+
+    def components(self, keep):
+        """ component of every kept node and the components, in reverse topological order (Tarjan) """
+        n = len(self.succ)
+        index = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        comp = [-1] * n
+        stack = []
+        comps = []
+        counter = 0
+        for root in range(n):
+            if index[root] != -1 or not keep[root]:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            # explicit stack of (node, next successor to visit), a long chain does not hit the recursion limit
+            work = [(root, 0)]
+            while work:
+                v, i = work.pop()
+                succ = self.succ[v]
+                descended = False
+                while i < len(succ):
+                    w = succ[i]
+                    i += 1
+                    if not keep[w]:
+                        continue
+                    if index[w] == -1:
+                        work.append((v, i))
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = True
+                        work.append((w, 0))
+                        descended = True
+                        break
+                    if on_stack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                if descended:
+                    continue
+                if low[v] == index[v]:
+                    members = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        comp[w] = len(comps)
+                        members.append(w)
+                        if w == v:
+                            break
+                    comps.append(members)
+                if work and low[v] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[v]
+        return comp, comps
+
+    def metrics(self, keep=None):
+        if keep is None:
+            keep = [True] * len(self.succ)
+        nodes = [u for u in range(len(self.succ)) if keep[u]]
+        fan_out = {u: 0 for u in nodes}
+        fan_in = {u: 0 for u in nodes}
+        self_loops = False
+        for u in nodes:
+            for w in self.succ[u]:
+                if keep[w]:
+                    fan_out[u] += 1
+                    fan_in[w] += 1
+                    self_loops = self_loops or w == u
+        comp, comps = self.components(keep)
+        # the components reachable from a component come before it
+        depth = [0] * len(comps)
+        for c, members in enumerate(comps):
+            for u in members:
+                for w in self.succ[u]:
+                    if keep[w] and comp[w] != c and depth[comp[w]] + 1 > depth[c]:
+                        depth[c] = depth[comp[w]] + 1
+        edges = sum(fan_out.values())
+        scc_sizes = sorted((len(members) for members in comps if len(members) > 1), reverse=True)
+        return {'nodes': len(nodes),
+                'edges': edges,
+                'avg_deps_per_service': edges / len(nodes) if nodes else 0,
+                'acyclic': not scc_sizes and not self_loops,
+                'longest_path': max(depth, default=0),
+                'max_fan_in': max(fan_in.values(), default=0),
+                'max_fan_out': max(fan_out.values(), default=0),
+                'fan_in': histogram(fan_in.values()),
+                'fan_out': histogram(fan_out.values()),
+                'sccs': len(comps),
+                'scc_sizes': scc_sizes}
+
+
+def histogram(degrees):
+    """ number of nodes with degree 0, 1, ... """
+    counts = []
+    for d in degrees:
+        if d >= len(counts):
+            counts += [0] * (d + 1 - len(counts))
+        counts[d] += 1
+    return counts
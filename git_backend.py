@@ -0,0 +1,173 @@
+import concurrent.futures
+import os
+import subprocess
+from fnmatch import fnmatchcase
+
+from repo_index import INDEXED_FILES, RepoIndex, is_wildcard
+
+# ls-tree modes of the entries a checkout would turn into regular files
+FILE_MODES = {'100644', '100755'}
+# git ls-remote run at the same time by remote_heads, and seconds each may take
+LS_REMOTE_WORKERS = 16
+LS_REMOTE_TIMEOUT = 60
+
+
+def ls_tree(git_dir, rev='HEAD', sizes=True):
+    """ (path, blob id, size) of every regular file in the tree of rev
+    sizes=False: the sizes are 0. -l needs the blobs, in a partial clone git fetches every missing one, one at a time
+    """
+    result = subprocess.run(['git', '--git-dir', git_dir, 'ls-tree', '-r'] + (['-l'] if sizes else []) + ['-z', rev],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    entries = []
+    for line in result.stdout.decode('utf-8', 'surrogateescape').split('\0'):
+        if not line:
+            continue
+        info, name = line.split('\t', 1)
+        fields = info.split()
+        mode, kind, oid = fields[:3]
+        if kind == 'blob' and mode in FILE_MODES:
+            entries.append((name, oid, int(fields[3]) if sizes else 0))
+    return entries
+
+
+def tree_id(git_dir, rev='HEAD'):
+    result = subprocess.run(['git', '--git-dir', git_dir, 'rev-parse', rev + '^{tree}'],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return result.stdout.decode().strip()
+
+
+def head(git_dir, rev='HEAD'):
+    """ (commit id, tree id) of rev """
+    result = subprocess.run(['git', '--git-dir', git_dir, 'rev-parse', rev, rev + '^{tree}'],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    commit, tree = result.stdout.decode().split()
+    return commit, tree
+
+
+def root_commits(git_dir, rev='HEAD'):
+    """ ids of the commits without parents rev descends from, the boundary of a shallow clone """
+    result = subprocess.run(['git', '--git-dir', git_dir, 'rev-list', '--max-parents=0', rev],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return sorted(result.stdout.decode().split())
+
+
+def ls_remote_head(url, timeout=LS_REMOTE_TIMEOUT):
+    """ commit id of HEAD on the remote, nothing is fetched; None for an empty repository """
+    # never wait for a password prompt
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0',
+               GIT_SSH_COMMAND=os.environ.get('GIT_SSH_COMMAND', 'ssh -o BatchMode=yes'))
+    result = subprocess.run(['git', 'ls-remote', url, 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            stdin=subprocess.DEVNULL, check=True, timeout=timeout, env=env)
+    line = result.stdout.decode().partition('\n')[0]
+    return line.split('\t')[0] if line else None
+
+
+def remote_heads(urls, workers=LS_REMOTE_WORKERS):
+    """ url -> commit id of HEAD, for the urls whose remote answered """
+    def query(url):
+        try:
+            return url, ls_remote_head(url)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            return url, False
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return {url: commit for url, commit in executor.map(query, urls) if commit is not False}
+
+
+def top_trees(git_dir, rev='HEAD'):
+    """ name -> tree id of the directories at the root of rev """
+    result = subprocess.run(['git', '--git-dir', git_dir, 'ls-tree', '-z', rev],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    trees = {}
+    for line in result.stdout.decode('utf-8', 'surrogateescape').split('\0'):
+        if not line:
+            continue
+        info, name = line.split('\t', 1)
+        mode, kind, oid = info.split()
+        if kind == 'tree':
+            trees[name] = oid
+    return trees
+
+
+def pack_size(git_dir):
+    """ bytes of the packs in the object database, about what the clone downloaded """
+    try:
+        with os.scandir(os.path.join(git_dir, 'objects', 'pack')) as it:
+            return sum(entry.stat().st_size for entry in it if entry.name.endswith('.pack'))
+    except OSError:
+        return 0
+
+
+def walk_order(name):
+    # files of a directory first, then the content of its subdirectories, like the working tree walk
+    parts = name.split('/')
+    return [(1, p) for p in parts[:-1]] + [(0, parts[-1])]
+
+
+def index_tree(git_dir, patterns=INDEXED_FILES, rev='HEAD', sizes=True):
+    index = RepoIndex(patterns)
+    wildcards = [p for p in index.patterns if is_wildcard(p)]
+    for name, oid, size in sorted(ls_tree(git_dir, rev, sizes), key=lambda x: walk_order(x[0])):
+        index.size += size
+        index.num_files += 1
+        rel_path = '/' + name
+        index.entries.append((rel_path, size))
+        basename = name.rsplit('/', 1)[-1]
+        if basename in index.files and basename not in wildcards:
+            index.files[basename].append(rel_path)
+            index.blobs[rel_path] = oid
+        for p in wildcards:
+            if fnmatchcase(basename, p):
+                index.files[p].append(rel_path)
+                index.blobs[rel_path] = oid
+    return index
+
+
+class GitObjectSource:
+    """ Reads the files of a repository straight from its object database
+    The tree of rev is listed once, the blobs are streamed through a single git cat-file --batch process
+    """
+
+    def __init__(self, git_dir, patterns=INDEXED_FILES, rev='HEAD'):
+        self.git_dir = git_dir
+        self.index = index_tree(git_dir, patterns, rev)
+        self._process = None
+
+    def _cat_file(self):
+        if self._process is None:
+            self._process = subprocess.Popen(['git', '--git-dir', self.git_dir, 'cat-file', '--batch'],
+                                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return self._process
+
+    def read(self, rel_path):
+        oid = self.index.blobs.get(rel_path)
+        if oid is None:
+            raise FileNotFoundError(rel_path)
+        process = self._cat_file()
+        process.stdin.write(oid.encode() + b'\n')
+        process.stdin.flush()
+        header = process.stdout.readline().split()
+        if len(header) != 3:
+            raise FileNotFoundError(rel_path)
+        size = int(header[2])
+        data = process.stdout.read(size)
+        process.stdout.read(1)
+        return data
+
+    def close(self):
+        if self._process is not None:
+            self._process.stdin.close()
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                # a forked child still holds our end of the pipe, so cat-file does not see the EOF
+                self._process.kill()
+                self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,69 @@
+import threading
+
+
+class HeadOwners:
+    """ Which repo has the result describing each commit, when the forks and mirrors are linked instead of analyzed
+    A repo owns its commit once its result is written. Until then the first repo of the run with that HEAD claims
+    it and the next ones wait: they are linked once the result is written, or the first of them claims the commit
+    when the repo ends without a result for it. Shared by the threads of the run
+    """
+
+    def __init__(self, owners=None):
+        self.lock = threading.Lock()
+        # commit -> name, and the commit owned by each name
+        self.owners = dict(owners or {})
+        self.commits = {name: commit for commit, name in self.owners.items()}
+        # name -> commit claimed, and commit -> (name, url, project id) of the repos waiting for it
+        self.claims = {}
+        self.waiting = {}
+
+    def claim(self, commit, name, repo_url, project_id=None):
+        """ name of the repo to link to; name itself when the repo is to be analyzed, None when it waits """
+        with self.lock:
+            owner = self.owners.get(commit)
+            if owner is not None or self.claims.get(name) == commit:
+                return owner or name
+            if commit in self.waiting:
+                self.waiting[commit].append((name, repo_url, project_id))
+                return None
+            self.claims[name] = commit
+            self.waiting[commit] = []
+            return name
+
+    def written(self, name, commit):
+        """ records the result of name, returns the owner of commit and the (name, url, project id) to link to it """
+        with self.lock:
+            self._disown(name)
+            owner = self.owners.setdefault(commit, name)
+            if owner == name:
+                self.commits[name] = commit
+            if self.claims.get(name) != commit:
+                return owner, []
+            del self.claims[name]
+            return owner, self.waiting.pop(commit)
+
+    def release(self, name):
+        """ once the repo is done: when it got no result for the commit it claimed, the first repo waiting for it
+        claims it instead, its (url, project id) is returned to be analyzed
+        """
+        with self.lock:
+            commit = self.claims.pop(name, None)
+            if commit is None:
+                return None
+            waiting = self.waiting.pop(commit)
+            if not waiting:
+                return None
+            fork, project_id = waiting[0][1:]
+            self.claims[waiting[0][0]] = commit
+            self.waiting[commit] = waiting[1:]
+            return fork, project_id
+
+    def disown(self, name):
+        """ the result of name is going to describe another commit, its remote HEAD moved """
+        with self.lock:
+            self._disown(name)
+
+    def _disown(self, name):
+        commit = self.commits.pop(name, None)
+        if commit is not None:
+            del self.owners[commit]
@@ -0,0 +1,231 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+
+# languages are only counted when linguist counts them: programming and markup languages.
+# Data and prose (JSON, YAML, XML, SQL, Markdown, Gradle, ...) are left out of the tables on purpose
+EXTENSIONS = {
+    '.abap': 'ABAP', '.ada': 'Ada', '.adb': 'Ada', '.ads': 'Ada', '.applescript': 'AppleScript',
+    '.apex': 'Apex', '.asm': 'Assembly', '.nasm': 'Assembly', '.s': 'Assembly',
+    '.asp': 'Classic ASP', '.aspx': 'ASP.NET', '.ascx': 'ASP.NET', '.asax': 'ASP.NET', '.awk': 'Awk',
+    '.bat': 'Batchfile', '.cmd': 'Batchfile', '.bicep': 'Bicep', '.blade.php': 'Blade',
+    '.c': 'C', '.cats': 'C', '.cs': 'C#', '.csx': 'C#', '.cake': 'C#',
+    '.cpp': 'C++', '.cc': 'C++', '.cxx': 'C++', '.c++': 'C++', '.hpp': 'C++', '.hh': 'C++', '.hxx': 'C++',
+    '.h++': 'C++', '.inl': 'C++', '.ipp': 'C++', '.tpp': 'C++', '.ino': 'C++',
+    '.clj': 'Clojure', '.cljs': 'Clojure', '.cljc': 'Clojure', '.edn': 'Clojure', '.cmake': 'CMake',
+    '.cob': 'COBOL', '.cbl': 'COBOL', '.cpy': 'COBOL', '.coffee': 'CoffeeScript', '.cr': 'Crystal',
+    '.css': 'CSS', '.cu': 'Cuda', '.cuh': 'Cuda', '.dart': 'Dart', '.dockerfile': 'Dockerfile',
+    '.containerfile': 'Dockerfile', '.ejs': 'EJS', '.ex': 'Elixir', '.exs': 'Elixir', '.elm': 'Elm',
+    '.el': 'Emacs Lisp', '.erl': 'Erlang', '.hrl': 'Erlang', '.fs': 'F#', '.fsi': 'F#', '.fsx': 'F#',
+    '.f': 'Fortran', '.for': 'Fortran', '.f77': 'Fortran', '.f90': 'Fortran', '.f95': 'Fortran',
+    '.f03': 'Fortran', '.ftl': 'FreeMarker', '.feature': 'Gherkin', '.glsl': 'GLSL', '.vert': 'GLSL',
+    '.frag': 'GLSL', '.go': 'Go', '.groovy': 'Groovy', '.gvy': 'Groovy', '.gsp': 'Groovy Server Pages',
+    '.hack': 'Hack', '.hbs': 'Handlebars', '.handlebars': 'Handlebars', '.hs': 'Haskell', '.lhs': 'Haskell',
+    '.hx': 'Haxe', '.hcl': 'HCL', '.tf': 'HCL', '.tfvars': 'HCL', '.hlsl': 'HLSL',
+    '.html': 'HTML', '.htm': 'HTML', '.xhtml': 'HTML', '.html.erb': 'HTML+ERB', '.erb': 'HTML+ERB',
+    '.cshtml': 'HTML+Razor', '.razor': 'HTML+Razor', '.java': 'Java', '.jsp': 'Java Server Pages',
+    '.js': 'JavaScript', '.mjs': 'JavaScript', '.cjs': 'JavaScript', '.jsx': 'JavaScript',
+    '.jl': 'Julia', '.ipynb': 'Jupyter Notebook', '.kt': 'Kotlin', '.kts': 'Kotlin',
+    '.less': 'Less', '.liquid': 'Liquid', '.lisp': 'Common Lisp', '.lsp': 'Common Lisp', '.lua': 'Lua',
+    '.mak': 'Makefile', '.mk': 'Makefile', '.mako': 'Mako', '.mustache': 'Mustache', '.nim': 'Nim',
+    '.nix': 'Nix', '.njk': 'Nunjucks', '.mm': 'Objective-C++', '.ml': 'OCaml', '.mli': 'OCaml',
+    '.pas': 'Pascal', '.pp': 'Puppet', '.php': 'PHP', '.phtml': 'PHP', '.pm': 'Perl', '.t': 'Perl',
+    '.ps1': 'PowerShell', '.psm1': 'PowerShell', '.psd1': 'PowerShell', '.pde': 'Processing',
+    '.pug': 'Pug', '.jade': 'Pug', '.purs': 'PureScript', '.py': 'Python', '.pyw': 'Python',
+    '.pyx': 'Cython', '.pxd': 'Cython', '.qml': 'QML', '.r': 'R', '.rmd': 'RMarkdown', '.rkt': 'Racket',
+    '.raku': 'Raku', '.rb': 'Ruby', '.rake': 'Ruby', '.gemspec': 'Ruby', '.rs': 'Rust', '.sas': 'SAS',
+    '.sass': 'Sass', '.scala': 'Scala', '.sc': 'Scala', '.scm': 'Scheme', '.ss': 'Scheme', '.scss': 'SCSS',
+    '.sh': 'Shell', '.bash': 'Shell', '.zsh': 'Shell', '.ksh': 'Shell', '.sls': 'SaltStack',
+    '.tpl': 'Smarty', '.sol': 'Solidity', '.sml': 'Standard ML', '.bzl': 'Starlark',
+    '.star': 'Starlark', '.styl': 'Stylus', '.svelte': 'Svelte', '.swift': 'Swift', '.tcl': 'Tcl',
+    '.tex': 'TeX', '.sty': 'TeX', '.twig': 'Twig', '.ts': 'TypeScript', '.tsx': 'TypeScript',
+    '.mts': 'TypeScript', '.cts': 'TypeScript', '.vb': 'Visual Basic .NET', '.vbs': 'VBScript',
+    '.vim': 'Vim Script', '.vue': 'Vue', '.wat': 'WebAssembly', '.xsl': 'XSLT', '.xslt': 'XSLT',
+    '.zig': 'Zig',
+}
+
+# extensions shared by several languages; linguist looks at the content, here the language
+# the rest of the repository is mostly written in wins, the first candidate otherwise
+AMBIGUOUS_EXTENSIONS = {
+    '.h': ['C', 'C++', 'Objective-C'],
+    '.m': ['Objective-C', 'MATLAB'],
+    '.pl': ['Perl', 'Prolog'],
+}
+
+FILENAMES = {
+    'Dockerfile': 'Dockerfile', 'Containerfile': 'Dockerfile', 'Makefile': 'Makefile',
+    'makefile': 'Makefile', 'GNUmakefile': 'Makefile', 'CMakeLists.txt': 'CMake',
+    'Jenkinsfile': 'Groovy', 'Rakefile': 'Ruby', 'Gemfile': 'Ruby', 'Vagrantfile': 'Ruby',
+    'Podfile': 'Ruby', 'Fastfile': 'Ruby', 'Brewfile': 'Ruby', 'Guardfile': 'Ruby', 'Capfile': 'Ruby',
+    'Berksfile': 'Ruby', 'Thorfile': 'Ruby', 'Snakefile': 'Python', 'SConstruct': 'Python',
+    'SConscript': 'Python', 'BUILD': 'Starlark', 'BUILD.bazel': 'Starlark', 'WORKSPACE': 'Starlark',
+    'Tiltfile': 'Starlark', '.bashrc': 'Shell', '.bash_profile': 'Shell', '.profile': 'Shell',
+    '.zshrc': 'Shell', 'PKGBUILD': 'Shell', '.vimrc': 'Vim Script',
+}
+
+# paths linguist leaves out of the statistics: vendored code, documentation and generated files
+EXCLUDED_PATHS = re.compile('|'.join([
+    # vendored
+    r'(^|/)(node_modules|bower_components|jspm_packages|\.yarn)/',
+    r'(^|/)[Vv]endors?/', r'(^|/)(third|3rd)[-_]?party/', r'(^|/)extern(al)?/', r'^deps/',
+    r'(^|/)[Dd]ependencies/', r'(^|/)Pods/', r'(^|/)Carthage/', r'(^|/)Godeps/', r'(^|/)cache/',
+    r'(^|/)(\.?venv|virtualenv|site-packages)/', r'(^|/)dist/',
+    r'(^|/)gradlew(\.bat)?$', r'(^|/)gradle/wrapper/', r'(^|/)mvnw(\.cmd)?$', r'(^|/)\.mvn/wrapper/',
+    r'(^|/)(configure|config\.guess|config\.sub)$', r'(\.|-)min\.(js|css)$', r'(^|/)jquery[^/]*\.js$',
+    r'(^|/)bootstrap[^/.]*(\.[^/]*)?\.(js|css|less|scss)$', r'(^|/)angular[^/.]*\.js$',
+    # documentation
+    r'^[Dd]ocs?/', r'(^|/)[Dd]ocumentation/', r'(^|/)[Ee]xamples?/', r'(^|/)[Ss]amples?/', r'^[Mm]an/',
+    r'(^|/)(CHANGES?|CHANGELOG|CONTRIBUTING|COPYING|INSTALL|LICEN[CS]E|README)(\.|$)',
+    # generated
+    r'\.(pb\.(go|cc|h)|g\.dart|freezed\.dart|designer\.cs|js\.map|css\.map)$', r'_pb2(_grpc)?\.py$',
+    r'(^|/)__generated__/', r'\.xcodeproj/',
+]))
+
+THRESHOLD = 10
+# part of the cache keys, bump it when the tables above change so the old entries are not used any more
+VERSION = 1
+# cached entries kept by LanguageCache, the least recently used ones are evicted past it
+CACHE_SIZE = 200000
+
+
+def extensions(name):
+    """ '.blade.php' before '.php' for 'a.blade.php', a leading dot alone is not an extension """
+    start = 1 if name.startswith('.') else 0
+    i = name.find('.', start)
+    while i != -1:
+        yield name[i:].lower()
+        i = name.find('.', i + 1)
+
+
+def language_of(rel_path):
+    """ (language, None), (None, extension) for an ambiguous extension, (None, None) if not counted """
+    rel_path = rel_path.lstrip('/')
+    if EXCLUDED_PATHS.search(rel_path):
+        return None, None
+    name = rel_path.rsplit('/', 1)[-1]
+    if name in FILENAMES:
+        return FILENAMES[name], None
+    for ext in extensions(name):
+        if ext in EXTENSIONS:
+            return EXTENSIONS[ext], None
+        if ext in AMBIGUOUS_EXTENSIONS:
+            return None, ext
+    return None, None
+
+
+def count_languages(files):
+    """ (bytes per language, bytes per ambiguous extension) of (path, size) pairs """
+    sizes = {}
+    ambiguous = {}
+    for rel_path, size in files:
+        language, ext = language_of(rel_path)
+        if language is not None:
+            sizes[language] = sizes.get(language, 0) + size
+        elif ext is not None:
+            ambiguous[ext] = ambiguous.get(ext, 0) + size
+    return sizes, ambiguous
+
+
+def merge_counts(counts):
+    sizes = {}
+    ambiguous = {}
+    for part_sizes, part_ambiguous in counts:
+        for language, size in part_sizes.items():
+            sizes[language] = sizes.get(language, 0) + size
+        for ext, size in part_ambiguous.items():
+            ambiguous[ext] = ambiguous.get(ext, 0) + size
+    return sizes, ambiguous
+
+
+def stats_of_counts(counts):
+    """ Same shape as github-linguist --json: language -> {'size': bytes, 'percentage': '12.34'}, largest first """
+    known, ambiguous = counts
+    sizes = dict(known)
+    for ext, size in ambiguous.items():
+        candidates = AMBIGUOUS_EXTENSIONS[ext]
+        language = max(candidates, key=lambda c: known.get(c, 0))
+        sizes[language] = sizes.get(language, 0) + size
+    total = sum(sizes.values())
+    stats = {}
+    for language, size in sorted(sizes.items(), key=lambda x: -x[1]):
+        if size:
+            stats[language] = {'size': size, 'percentage': '%.2f' % (size * 100 / total,)}
+    return stats
+
+
+def language_stats(files):
+    return stats_of_counts(count_languages(files))
+
+
+def main_languages(stats, threshold=THRESHOLD):
+    return [lang.lower() for lang in stats if float(stats[lang]['percentage']) > threshold]
+
+
+class LanguageCache:
+    """ Language results keyed by git tree id, in an sqlite file the worker processes and later runs share
+    The entries not read for the longest time are evicted once there are more than max_entries
+    """
+
+    def __init__(self, path, max_entries=CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # lookups of the top level directories of the big repos, counted apart from the whole trees
+        self.subtree_hits = 0
+        self.subtree_misses = 0
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS languages (key TEXT PRIMARY KEY, data TEXT, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS languages_used ON languages (used)')
+        self.db.commit()
+        self.writes = 0
+
+    def get(self, key, subtree=False):
+        with self.lock:
+            row = self.db.execute('SELECT data FROM languages WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                if subtree:
+                    self.subtree_misses += 1
+                else:
+                    self.misses += 1
+                return None
+            if subtree:
+                self.subtree_hits += 1
+            else:
+                self.hits += 1
+            self.db.execute('UPDATE languages SET used = ? WHERE key = ?', (time.time(), key))
+            self.db.commit()
+        return json.loads(row[0])
+
+    def put(self, key, data):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO languages VALUES (?, ?, ?)', (key, json.dumps(data), time.time()))
+            self.writes += 1
+            # counting the rows on every write would cost more than the eviction itself
+            if self.writes % 1000 == 0:
+                self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        self.db.execute('DELETE FROM languages WHERE key IN '
+                        '(SELECT key FROM languages ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def report(self):
+        lookups = self.hits + self.misses
+        report = 'Language cache: %d hits, %d misses (%.1f%% hit rate)' % (
+            self.hits, self.misses, self.hits * 100 / lookups if lookups else 0)
+        subtree_lookups = self.subtree_hits + self.subtree_misses
+        if subtree_lookups:
+            report += '; directories of the big repos: %d hits, %d misses (%.1f%% hit rate)' % (
+                self.subtree_hits, self.subtree_misses, self.subtree_hits * 100 / subtree_lookups)
+        return report
+
+    def close(self):
+        with self.lock:
+            self._evict()
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,228 @@
+import http.client
+import json
+import queue
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+GITHUB_API = 'https://api.github.com'
+# repositories per GraphQL query, the API accepts up to 100 aliased fields
+BATCH_SIZE = 100
+# idle kept-alive connections a GitHubClient keeps for the next requests
+POOL_SIZE = 8
+
+
+class MetadataCache:
+    """ On-disk cache of the repository metadata, keyed by full repo name (user/repo) """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, data TEXT, fetched REAL)')
+        self.db.commit()
+
+    def get(self, name):
+        with self.lock:
+            row = self.db.execute('SELECT data FROM metadata WHERE name = ?', (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def missing(self, names):
+        with self.lock:
+            return [name for name in names
+                    if self.db.execute('SELECT 1 FROM metadata WHERE name = ?', (name,)).fetchone() is None]
+
+    def put_many(self, items):
+        now = time.time()
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?)',
+                                [(name, json.dumps(data), now) for name, data in items])
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class GitHubClient:
+    """ Repository metadata over a pool of kept-alive HTTP connections
+    Every request takes a connection of its own, the prefetcher and the workers falling back to single lookups
+    do not wait for each other. With a token the sizes are asked through GraphQL, BATCH_SIZE repositories per
+    request, without it through the REST endpoint the old curl call used, one repository per request
+    """
+
+    def __init__(self, api=GITHUB_API, token=None, timeout=30, pool_size=POOL_SIZE):
+        parts = urlsplit(api)
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.https = parts.scheme == 'https'
+        self.token = token
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def _connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self._connect()
+
+    def _release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.pool_size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, endpoint, body=None):
+        headers = {'User-Agent': 'microservices-analysis', 'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = 'bearer %s' % (self.token,)
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        connection = self._acquire()
+        # a kept-alive connection may have been closed by the server meanwhile: retry once on a new one
+        for attempt in range(2):
+            try:
+                connection.request(method, self.prefix + endpoint, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                if attempt:
+                    raise
+                connection = self._connect()
+            except Exception:
+                connection.close()
+                raise
+            else:
+                self._release(connection)
+                return response.status, json.loads(data.decode('utf-8') or 'null')
+
+    def repository(self, name):
+        """ metadata of one repository, None when the answer must not be cached (rate limit, errors) """
+        status, data = self.request('GET', '/repos/%s' % (name,))
+        if status == 200 and isinstance(data, dict) and 'size' in data:
+            return {'size': data['size']}
+        if status == 404:
+            return {}
+        return None
+
+    def repositories(self, names):
+        """ name -> metadata for every name the batch could answer """
+        if not self.token:
+            result = {}
+            for name in names:
+                data = self.repository(name)
+                if data is not None:
+                    result[name] = data
+            return result
+        fields = []
+        aliases = {}
+        for i, name in enumerate(names):
+            owner, _, repo = name.partition('/')
+            aliases['r%d' % (i,)] = name
+            fields.append('r%d: repository(owner: %s, name: %s) { diskUsage }'
+                          % (i, json.dumps(owner), json.dumps(repo)))
+        status, data = self.request('POST', '/graphql', {'query': 'query { %s }' % (' '.join(fields),)})
+        if status != 200 or not isinstance(data, dict) or not isinstance(data.get('data'), dict):
+            return {}
+        result = {}
+        for alias, repo in data['data'].items():
+            if alias not in aliases:
+                continue
+            # diskUsage has the same unit (KB) as the size of the REST API
+            if repo is None:
+                result[aliases[alias]] = {}
+            elif repo.get('diskUsage') is not None:
+                result[aliases[alias]] = {'size': repo['diskUsage']}
+        return result
+
+    def close(self):
+        with self.lock:
+            for connection in self.idle:
+                connection.close()
+            self.idle = []
+
+
+class MetadataPrefetcher:
+    """ Fills the cache in batches from a background thread, ahead of the clone workers
+    prefetch() only queues the names, the thread fetches them in turn. get() is a local lookup for every
+    prefetched repository and falls back to a single request otherwise
+    """
+
+    def __init__(self, cache, client, batch_size=BATCH_SIZE):
+        self.cache = cache
+        self.client = client
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = None
+        self.stop = threading.Event()
+
+    def _run(self):
+        while True:
+            names = self.queue.get()
+            try:
+                if names is None:
+                    return
+                self._prefetch(names)
+            finally:
+                self.queue.task_done()
+
+    def _prefetch(self, names):
+        batch = []
+        for name in names:
+            if self.stop.is_set():
+                return
+            batch.append(name)
+            if len(batch) == self.batch_size:
+                self._fetch_batch(batch)
+                batch = []
+        if batch:
+            self._fetch_batch(batch)
+
+    def _fetch_batch(self, batch):
+        try:
+            missing = self.cache.missing(batch)
+            if missing:
+                self.cache.put_many(self.client.repositories(missing).items())
+        except Exception:
+            # the workers fetch whatever is left on their own
+            pass
+
+    def prefetch(self, names):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.queue.put(names)
+
+    def get(self, name):
+        data = self.cache.get(name)
+        if data is not None:
+            return data
+        data = self.client.repository(name)
+        if data is None:
+            return {}
+        self.cache.put_many([(name, data)])
+        return data
+
+    def join(self):
+        """ waits for the names queued so far """
+        self.queue.join()
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.client.close()
+        self.cache.close()
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from os import path
+
+import git
+from filelock import FileLock, Timeout
+
+# default size cap of the mirrors, in bytes
+CACHE_SIZE = 100 * 1024 ** 3
+# refs kept in a mirror: the branches and the tags, not the refs/pull/* and the other refs of the host
+REFSPECS = ['+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+
+
+def dir_size(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.lstat(path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class MirrorCache:
+    """ Bare mirrors of the repos under directory, one per URL, kept from one run to the next
+    A repo is fetched into its mirror instead of cloned again, the analysis then clones the mirror
+    locally (hard links, no copy). The mirrors not used for the longest time are removed once they
+    take more than max_bytes. Each mirror has a file lock, several processes can share the directory
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_SIZE):
+        # the clones run in temp/<user>, the mirrors are given to them by absolute path
+        self.directory = path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path.join(directory, 'mirrors.db'), check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS mirrors (url TEXT PRIMARY KEY, size INTEGER, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS mirrors_used ON mirrors (used)')
+        self.db.commit()
+
+    def path_of(self, url):
+        return path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.git')
+
+    def _lock(self, url, timeout=-1):
+        return FileLock(self.path_of(url) + '.lock', timeout=timeout)
+
+    @contextmanager
+    def mirror(self, url, remote=None):
+        """ path of the mirror of url, fetched up to date; it is not evicted until the block ends
+        remote: where to fetch from, url by default
+        """
+        mirror = self.path_of(url)
+        with self._lock(url):
+            if path.exists(mirror):
+                self.hits += 1
+                # the mirrors cloned with --mirror fetched every ref, their refspecs are set again
+                self.fetch(mirror)
+            else:
+                self.misses += 1
+                # cloned aside and renamed, a clone cut half way is never taken for a mirror
+                partial = mirror + '.partial'
+                shutil.rmtree(partial, ignore_errors=True)
+                git.Git(self.directory).clone('--bare', remote or url, partial)
+                self.fetch(partial)
+                os.rename(partial, mirror)
+            size = dir_size(mirror)
+            with self.lock:
+                self.db.execute('INSERT OR REPLACE INTO mirrors VALUES (?, ?, ?)', (url, size, time.time()))
+                self.db.commit()
+            yield mirror
+        self.evict()
+
+    @staticmethod
+    def fetch(mirror):
+        """ fetches the branches and the tags of the mirror, the ones removed upstream are removed """
+        repo = git.Git(mirror)
+        repo.config('--replace-all', 'remote.origin.fetch', REFSPECS[0])
+        for refspec in REFSPECS[1:]:
+            repo.config('--add', 'remote.origin.fetch', refspec)
+        repo.config('remote.origin.mirror', 'false')
+        repo.fetch('--prune', 'origin')
+
+    def evict(self):
+        with self.lock:
+            total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM mirrors').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = self.db.execute('SELECT url, size FROM mirrors ORDER BY used').fetchall()
+        for url, size in victims:
+            if total <= self.max_bytes:
+                break
+            try:
+                # a mirror in use is skipped, the next one goes instead
+                with self._lock(url, timeout=0):
+                    shutil.rmtree(self.path_of(url), ignore_errors=True)
+                    with self.lock:
+                        self.db.execute('DELETE FROM mirrors WHERE url = ?', (url,))
+                        self.db.commit()
+            except Timeout:
+                continue
+            total -= size
+
+    def report(self):
+        return 'Mirror cache: %d fetched, %d cloned' % (self.hits, self.misses)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,20 +1,17 @@
-from pathlib import Path
-import json
+import sys
 
+from result_store import open_store
 
-repos = Path('results').glob('*.json')
-i = j = 0
+# python output_repo.py [store], see result_store.open_store
+store = open_store(sys.argv[1] if len(sys.argv) > 1 else 'results')
+j = 0
 output_repos = []
-for source in repos:
+for _, data in store.records():
     j += 1
-    try:
-        with open(str(source)) as json_file:
-            data = json.load(json_file)
-            if data['url']:
-                output_repos.append({'url': data['url'], 'name': data['name']})
-    except (UnicodeDecodeError, json.decoder.JSONDecodeError):
-        i += 1
-        pass
+    if data['url']:
+        output_repos.append({'url': data['url'], 'name': data['name']})
+i = store.errors
+j += i
 
 with open("repos.csv", "w") as output_file:
     for repo in output_repos:
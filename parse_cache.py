@@ -0,0 +1,86 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# bump when the output of analyze_dockerfile, analyze_docker_compose or analyze_file changes
+VERSION = 3
+CACHE_SIZE = 1000000
+# lookups between two writes of the last use times
+TOUCH_BATCH = 100
+
+
+def blob_id(data):
+    """ id git gives to a blob of these bytes """
+    return hashlib.sha1(b'blob %d\0' % (len(data),) + data).hexdigest()
+
+
+def data_digest(data):
+    """ digest of the consts the analyzers match against, a change of the lists invalidates the cache """
+    return hashlib.sha1(json.dumps({k: sorted(v) for k, v in data.items()}, sort_keys=True).encode()).hexdigest()[:12]
+
+
+class ParseCache:
+    """ Analysis of a Dockerfile, compose file or manifest keyed by kind, blob id and analyzer version,
+    in an sqlite file the threads, the parsing processes and later runs share
+    The entries not read for the longest time are evicted once there are more than max_entries
+    """
+
+    def __init__(self, path, version='', max_entries=CACHE_SIZE):
+        self.path = path
+        self.version = '%d.%s' % (VERSION, version)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.touched = []
+        self.writes = 0
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS parsed (key TEXT PRIMARY KEY, data TEXT, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS parsed_used ON parsed (used)')
+        self.db.commit()
+
+    def key(self, kind, oid):
+        return '%s:%s:%s' % (kind, self.version, oid)
+
+    def get(self, kind, oid):
+        key = self.key(kind, oid)
+        with self.lock:
+            row = self.db.execute('SELECT data FROM parsed WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            # the last use times are written in batches, a hit alone does not take the write lock
+            self.touched.append(key)
+            if len(self.touched) >= TOUCH_BATCH:
+                self._touch()
+                self.db.commit()
+        return json.loads(row[0])
+
+    def put(self, kind, oid, analysis):
+        try:
+            data = json.dumps(analysis)
+        except (TypeError, ValueError):
+            # yaml can give values json does not take, those files are parsed every time
+            return
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO parsed VALUES (?, ?, ?)', (self.key(kind, oid), data, time.time()))
+            self.writes += 1
+            if self.writes % 1000 == 0:
+                self._evict()
+            self.db.commit()
+
+    def _touch(self):
+        now = time.time()
+        self.db.executemany('UPDATE parsed SET used = ? WHERE key = ?', [(now, key) for key in self.touched])
+        self.touched = []
+
+    def _evict(self):
+        self.db.execute('DELETE FROM parsed WHERE key IN '
+                        '(SELECT key FROM parsed ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def close(self):
+        with self.lock:
+            self._touch()
+            self._evict()
+            self.db.commit()
+            self.db.close()
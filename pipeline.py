@@ -0,0 +1,75 @@
+import asyncio
+import concurrent.futures
+
+
+class Stage:
+    """ One step of the pipeline
+    func takes a job and returns it for the next stage, or None to drop it.
+    At most `concurrency` jobs are inside func at the same time, each in a thread of the stage's own pool
+    """
+
+    def __init__(self, name, func, concurrency=1):
+        self.name = name
+        self.func = func
+        self.concurrency = max(1, concurrency)
+
+
+_DONE = object()
+
+
+async def _feed(jobs, queue):
+    loop = asyncio.get_running_loop()
+    jobs = iter(jobs)
+    while True:
+        # the jobs are read from the CSVs and git: the next one is taken in a thread, not on the loop of the stages
+        job = await loop.run_in_executor(None, next, jobs, _DONE)
+        if job is _DONE:
+            break
+        # blocks while the first stage is behind: this is the backpressure on the input
+        await queue.put(job)
+    await queue.put(_DONE)
+
+
+async def _work(stage, executor, inbox, outbox, on_error):
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await inbox.get()
+        if job is _DONE:
+            # let the sibling workers see the end of the input too
+            await inbox.put(_DONE)
+            return
+        try:
+            job = await loop.run_in_executor(executor, stage.func, job)
+        except Exception as e:
+            on_error(stage, job, e)
+            continue
+        if job is not None and outbox is not None:
+            await outbox.put(job)
+
+
+async def _run_stage(stage, inbox, outbox, on_error):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=stage.concurrency,
+                                               thread_name_prefix=stage.name) as executor:
+        await asyncio.gather(*[_work(stage, executor, inbox, outbox, on_error) for _ in range(stage.concurrency)])
+    if outbox is not None:
+        await outbox.put(_DONE)
+
+
+async def run_pipeline(jobs, stages, queue_size=64, on_error=None):
+    """ Runs every job through the stages, each stage with its own concurrency limit
+    Stages are connected by bounded queues, so a slow stage makes the faster ones upstream wait
+    instead of piling up work; the throughput is the one of the slowest stage
+    """
+    if on_error is None:
+        def on_error(stage, job, e):
+            raise e
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    tasks = [_feed(jobs, queues[0])]
+    for i, stage in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        tasks.append(_run_stage(stage, queues[i], outbox, on_error))
+    await asyncio.gather(*tasks)
+
+
+def run(jobs, stages, queue_size=64, on_error=None):
+    asyncio.run(run_pipeline(jobs, stages, queue_size, on_error))
@@ -0,0 +1,131 @@
+import cProfile
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from os import path
+
+PROFILES_DIR = 'profiles'
+# seconds between two samples of the stack sampler
+SAMPLE_INTERVAL = 0.05
+
+
+class Timings:
+    """ Wall time, CPU time of the calling thread and bytes handled per stage of one repo
+    The records live in the dict given, analysis['timings'], so they travel with the analysis
+    to the parsing processes and end up in the result
+    """
+
+    def __init__(self, records):
+        self.records = records
+
+    @contextmanager
+    def stage(self, name):
+        record = self.records.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'bytes': 0})
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = round(record['wall'] + time.perf_counter() - wall, 4)
+            record['cpu'] = round(record['cpu'] + time.thread_time() - cpu, 4)
+
+
+def timings(analysis):
+    return Timings(analysis.setdefault('timings', {}))
+
+
+def collapse(frame):
+    """ root;...;leaf stack of frame, the folded format flame graph tools read """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (code.co_name, path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """ One thread that samples the stacks of the watched threads every interval seconds """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.watched = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def watch(self, thread_id):
+        samples = Counter()
+        with self.lock:
+            self.watched[thread_id] = samples
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self.thread.start()
+        return samples
+
+    def unwatch(self, thread_id):
+        with self.lock:
+            self.watched.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                watched = list(self.watched.items())
+            if not watched:
+                continue
+            frames = sys._current_frames()
+            # under the lock: once unwatch returns, the samples of that thread do not change any more
+            with self.lock:
+                for thread_id, samples in watched:
+                    frame = frames.get(thread_id)
+                    if frame is not None and self.watched.get(thread_id) is samples:
+                        samples[collapse(frame)] += 1
+
+
+class RepoProfiler:
+    """ cProfile on a random fraction of the repos; when a latency threshold is set, the other repos
+    are followed by the stack sampler and their samples are kept only if they took longer than it.
+    Profiles go to PROFILES_DIR: <name>.prof (pstats) and <name>.stacks (folded stacks)
+    """
+
+    def __init__(self, fraction=0.0, threshold=None, directory=PROFILES_DIR, interval=SAMPLE_INTERVAL):
+        self.fraction = fraction
+        self.threshold = threshold
+        self.directory = directory
+        self.sampler = StackSampler(interval) if threshold is not None else None
+        # one cProfile at a time, newer Pythons refuse a second active profiler
+        self.cprofile = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_of(self, name, ext):
+        return path.join(self.directory, '%s.%s' % (name.replace('/', '#'), ext))
+
+    @contextmanager
+    def profile(self, name):
+        if self.fraction and random.random() < self.fraction and self.cprofile.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self.cprofile.release()
+                profiler.dump_stats(self.path_of(name, 'prof'))
+            return
+        if self.sampler is None:
+            yield
+            return
+        thread_id = threading.get_ident()
+        samples = self.sampler.watch(thread_id)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sampler.unwatch(thread_id)
+            if time.perf_counter() - start > self.threshold:
+                with open(self.path_of(name, 'stacks'), 'w') as f:
+                    f.write(''.join('%s %d\n' % (stack, n) for stack, n in samples.most_common()))
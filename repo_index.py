@@ -0,0 +1,78 @@
+import os
+from fnmatch import fnmatchcase
+
+from compose import COMPOSE_FILES
+
+# file patterns looked up by analyze_repo, see locate_files
+INDEXED_FILES = ['Dockerfile'] + COMPOSE_FILES + ['requirements.txt', '*.gradle', 'pom.xml', 'package.json']
+PRUNED_DIRS = {'.git'}
+
+
+def is_wildcard(pattern):
+    return any(c in pattern for c in '*?[')
+
+
+class RepoIndex:
+    """ Result of a single walk of a working tree
+    files[pattern] holds the matching paths relative to the root (with a leading '/'), in pre-order:
+    the files of a directory by name, then its subdirectories by name, whatever the order of the file system,
+    so the working tree and the HEAD tree (git_backend.index_tree) give the same lists
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.files = {p: [] for p in self.patterns}
+        self.size = 0
+        self.num_files = 0
+        # (path, size) of every file, for the language statistics
+        self.entries = []
+        # path -> blob id, filled when the index is built from the object database
+        self.blobs = {}
+
+    def locate(self, pattern):
+        return list(self.files[pattern])
+
+
+def index_repo(workdir, patterns=INDEXED_FILES, pruned=PRUNED_DIRS):
+    index = RepoIndex(patterns)
+    literals = {}
+    wildcards = []
+    for p in index.patterns:
+        if is_wildcard(p):
+            wildcards.append(p)
+        else:
+            literals.setdefault(p, []).append(p)
+
+    # explicit stack: (absolute dir, relative dir), visited top-down like rglob
+    stack = [(workdir, '')]
+    while stack:
+        directory, rel = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            name = entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if name not in pruned:
+                        subdirs.append((entry.path, rel + '/' + name))
+                    continue
+                if not entry.is_file():
+                    continue
+                size = entry.stat().st_size
+            except OSError:
+                continue
+            rel_path = rel + '/' + name
+            index.size += size
+            index.num_files += 1
+            index.entries.append((rel_path, size))
+            for p in literals.get(name, ()):
+                index.files[p].append(rel_path)
+            for p in wildcards:
+                if fnmatchcase(name, p):
+                    index.files[p].append(rel_path)
+        stack.extend(reversed(subdirs))
+    return index
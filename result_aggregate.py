@@ -0,0 +1,182 @@
+import hashlib
+import json
+
+from result_store import open_store
+
+# bump when the contributions change, the cached ones are then read again
+CACHE_VERSION = 3
+
+KEYS = [ 'dbs', 'servers', 'buses', 'langs', 'gates', 'monitors', 'discos', 'images']
+NONSIZE_KEYS = ['images']
+SIZE_KEYS = ["num_%s" % (k,) for k in KEYS if k not in NONSIZE_KEYS]
+SIZE_KEYS.append("num_files")
+SIZE_KEYS.append("num_dockers")
+SIZE_KEYS.append("num_services")
+SIZE_KEYS.append("num_ms")
+SIZE_KEYS.append("size")
+SIZE_KEYS.append("avg_size_service")
+SIZE_KEYS.append("commiters")
+SIZE_KEYS.append("shared_dbs")
+
+CLEANER = {}
+
+for key in KEYS:
+    CLEANER[key] = [[''], {}]
+
+CLEANER['langs'][0] += ['css', 'html', 'jupyternotebook', 'vue', 'dockerfile', 'scratch', 'bash', 'shell', 'makefile']
+CLEANER['langs'][1].update({'golang' : 'go', 'gcc' : 'c', 'cmake': 'c'})
+
+CLEANER['images'][0] += ['base']
+CLEANER['servers'][0] += ['mongoose', 'zookeeper']
+CLEANER['dbs'][0] += ['max', 'zookeeper', 'db']
+CLEANER['dbs'][1].update({'sql' : 'mysql'})
+
+CLEANER['monitors'][0] += ['monitoring']
+CLEANER['gates'][0] += ['gateway', 'loadbalancer', 'loadbalancing']
+
+#CLEANER['gates'][1].update({'gateway' : '(G) nginx', 'loadbalancer': '(G) zuul', 'loadbalancing': ' (G) kong'}
+CLEANER['gates'][1].update({'nginx' : ' nginx (G)', 'zuul': 'zuul (G)', 'kong' : 'kong (G)', 'linkerd' : 'linkerd (G)'})
+
+# store, include set, min services and duplicates mode of a worker process, set by init_worker
+WORKER = {}
+
+
+def clean_data(data):
+    for key in KEYS:
+        data[key] = set(data[key]) - set(CLEANER[key][0])
+        syn = CLEANER[key][1]
+        data[key] = [syn[x] if x in syn else x for x in data[key]]
+
+    data['num_ms'] = max(2, data['num_services']-data['num_dbs']-data['num_buses']-data['num_discos']-data['num_monitors']-data['num_gates'])
+
+
+def contribution(data, min_services=0):
+    """ (values of KEYS, values of SIZE_KEYS, dependency graphs) a result adds, None when it is discarded """
+    clean_data(data)
+    if data['num_dockers'] > 30:
+        return None
+    # discard repos with microservices < min_services
+    num_ms = data['num_ms']
+    if num_ms < min_services:
+        return None
+    graphs = None
+    if data['structure']:
+        graphs = {'full': data['structure'].get('dep_graph_full'), 'micro': data['structure'].get('dep_graph_micro')}
+    return {key: data[key] for key in KEYS}, [data[key] for key in SIZE_KEYS], graphs
+
+
+class Aggregate:
+    """ DATA, SIZES and DEP_GRAPHS of analyze_result, folded from the contributions of the results """
+
+    def __init__(self):
+        self.data = {key: [[], [], []] for key in KEYS}
+        self.sizes = {k: [] for k in SIZE_KEYS}
+        self.dep_graphs = []
+        # records read, records kept and records that could not be decoded
+        self.total = 0
+        self.analyzed = 0
+        self.errors = 0
+
+    def add(self, contribution):
+        values, sizes, graphs = contribution
+        for key in KEYS:
+            self.data[key][0] += values[key]
+            if values[key]:
+                self.data[key][1].append(tuple(sorted(values[key])))
+            self.data[key][2].append(tuple(sorted(values[key])))
+
+        for key, value in zip(SIZE_KEYS, sizes):
+            self.sizes[key].append(value)
+
+        # save the dependencies graphs
+        if graphs:
+            self.dep_graphs.append(graphs)
+        self.analyzed += 1
+
+
+def cache_key(spec, include, min_services=0, duplicates='include'):
+    """ digest of everything the contributions of a store depend on besides the results: the store, the include set
+    (from the filter file or the repos/*.csv), the -s and -d arguments and the CLEANER lists
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps([CACHE_VERSION, spec, min_services, duplicates, CLEANER], sort_keys=True).encode())
+    for url in sorted(include):
+        h.update(url.encode('utf-8', 'surrogateescape') + b'\n')
+    return h.hexdigest()
+
+
+def init_worker(spec, include, min_services=0, duplicates='include'):
+    WORKER.update(store=open_store(spec), include=include, min_services=min_services, duplicates=duplicates)
+
+
+def read_units(units):
+    """ (key, (total, errors, entries)) of every (key, part) unit of the store of init_worker
+    entries, in the order of the records: ('result', name, contribution, included, commit) of the included results,
+    ('target', name, commit) of the others, only read by read_targets when they are the target of a link, and
+    ('link', name of the result, url, commit) for the duplicates counted as copies of the result they are linked to
+    """
+    store, include = WORKER['store'], WORKER['include']
+    read = []
+    for key, part in units:
+        errors = store.errors
+        total = 0
+        entries = []
+        for name, data in store.records(part):
+            total += 1
+            if 'duplicate_of' in data:
+                if WORKER['duplicates'] == 'include' and data['url'] in include:
+                    entries.append(('link', data['duplicate_of'], data['url'], data.get('commit')))
+                continue
+            if data['url'] and data['url'] in include:
+                entries.append(('result', name, contribution(data, WORKER['min_services']), True, data.get('commit')))
+            else:
+                entries.append(('target', name, data.get('commit')))
+        read.append((key, (total, store.errors - errors, entries)))
+    return read
+
+
+def pending_targets(units):
+    """ {key: names} of the 'target' entries of the (key, (total, errors, entries)) units that a link points to """
+    links = {(entry[1], entry[3]) for _, (_, _, entries) in units for entry in entries if entry[0] == 'link'}
+    pending = {}
+    for key, (_, _, entries) in units:
+        for entry in entries:
+            if entry[0] == 'target' and (entry[1], entry[2]) in links:
+                pending.setdefault(key, set()).add(entry[1])
+    return pending
+
+
+def read_targets(part, names, read):
+    """ (total, errors, entries) read with the 'target' entries of names turned into the not included results
+    of their contributions, read from the part of the store of init_worker
+    """
+    total, errors, entries = read
+    contributions = {name: contribution(data, WORKER['min_services'])
+                     for name, data in WORKER['store'].records(part) if name in names}
+    entries = [('result', entry[1], contributions[entry[1]], False, entry[2])
+               if entry[0] == 'target' and entry[1] in contributions else entry for entry in entries]
+    return total, errors, entries
+
+
+def fold(units):
+    """ Aggregate of the (total, errors, entries) of the units, in order
+    The linked duplicates come after all the results, each a copy of the result it is linked to while that result
+    describes the commit of the link: the links to a result analyzed again at another commit are left out
+    """
+    aggregate = Aggregate()
+    links = {}
+    for total, errors, entries in units:
+        aggregate.total += total
+        aggregate.errors += errors
+        for entry in entries:
+            if entry[0] == 'link':
+                links.setdefault((entry[1], entry[3]), []).append(entry[2])
+            elif entry[0] == 'result' and entry[3] and entry[2] is not None:
+                aggregate.add(entry[2])
+    if links:
+        for _, _, entries in units:
+            for entry in entries:
+                if entry[0] == 'result' and entry[2] is not None:
+                    for _ in links.get((entry[1], entry[4]), []):
+                        aggregate.add(entry[2])
+    return aggregate
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from os import path
+from pathlib import Path
+
+# results buffered before a write, a crash loses at most these
+BATCH_SIZE = 100
+# records per JSONL segment
+SEGMENT_SIZE = 10000
+# rows in a unit of the sqlite store (see units()), and records in a task of analyze_result.py
+PART_SIZE = 1000
+# how every JSONL record starts, the name is decoded alone from there
+NAME_PREFIX = '{"name": '
+DECODER = json.JSONDecoder()
+
+
+class DirectoryStore:
+    """ The original layout: one pretty-printed results/<name>.json per repo """
+
+    def __init__(self, directory='results'):
+        self.directory = directory
+        self.errors = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path_of(self, name):
+        outfile = path.join(self.directory, name.replace('/', '#').replace('_', '#', 1))
+        return "%s.json" % (outfile,)
+
+    def has(self, name):
+        return path.exists(self.path_of(name))
+
+    def put(self, name, record):
+        with open(self.path_of(name), 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=4)
+
+    def names(self):
+        # file names, as the resume check of analyze_all always got them
+        return os.listdir(self.directory)
+
+    def units(self):
+        """ (key, stamp, part, records) of every result file: records(part) reads it, even in another process,
+        and its stamp changes when the file is written again
+        """
+        units = []
+        for source in Path(self.directory).glob('*.json'):
+            try:
+                st = source.stat()
+            except OSError:
+                continue
+            units.append((str(source), (st.st_mtime_ns, st.st_size), [str(source)], 1))
+        return units
+
+    def records(self, part=None):
+        """ (name, record) of every result, or of the results of a part
+        Files that can not be decoded are counted in errors
+        """
+        for source in Path(self.directory).glob('*.json') if part is None else map(Path, part):
+            try:
+                with open(str(source)) as json_file:
+                    record = json.load(json_file)
+            except (UnicodeDecodeError, json.decoder.JSONDecodeError):
+                self.errors += 1
+                continue
+            yield record.get('name', source.stem), record
+
+    def __len__(self):
+        return len(os.listdir(self.directory))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    """ Results in one sqlite table, the repo name is the primary key """
+
+    def __init__(self, db_path, batch_size=BATCH_SIZE):
+        self.path = db_path
+        self.batch_size = batch_size
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results (name TEXT PRIMARY KEY, data TEXT)')
+        self.db.commit()
+
+    def has(self, name):
+        with self.lock:
+            return name in self.pending or \
+                self.db.execute('SELECT 1 FROM results WHERE name = ?', (name,)).fetchone() is not None
+
+    def put(self, name, record):
+        with self.lock:
+            self.pending[name] = json.dumps(record, ensure_ascii=False)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?)', list(self.pending.items()))
+            self.db.commit()
+            self.pending = {}
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def names(self):
+        self.flush()
+        with self.lock:
+            return [row[0] for row in self.db.execute('SELECT name FROM results')]
+
+    def units(self, size=PART_SIZE):
+        """ (key, stamp, part, records) of every range of size rowids
+        A result written again is deleted and inserted with a new rowid, so the count and the sum of the rowids
+        of a range change with its rows
+        """
+        self.flush()
+        with self.lock:
+            rows = self.db.execute('SELECT rowid / ?, COUNT(*), TOTAL(rowid) FROM results GROUP BY 1 ORDER BY 1',
+                                   (size,)).fetchall()
+        return [((n * size, (n + 1) * size), (count, total), (n * size, (n + 1) * size), count)
+                for n, count, total in rows]
+
+    def records(self, part=None):
+        self.flush()
+        # a connection of its own, the cursor streams the rows while the store keeps being written
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            query = 'SELECT name, data FROM results' + (' WHERE rowid >= ? AND rowid < ?' if part else '')
+            for name, data in db.execute(query, part or ()):
+                try:
+                    yield name, json.loads(data)
+                except json.decoder.JSONDecodeError:
+                    self.errors += 1
+        finally:
+            db.close()
+
+    def __len__(self):
+        self.flush()
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.db.close()
+
+
+class JsonlStore:
+    """ Append-only segments of one {"name": ..., "result": ...} line per repo
+    The names are also appended to names.txt, which is the index loaded for the resume checks.
+    A name written twice keeps its last record, e.g. a repo analyzed again by the update mode
+    """
+
+    def __init__(self, directory, batch_size=BATCH_SIZE, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.segment_size = segment_size
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.pending = []
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = path.join(directory, 'names.txt')
+        self.index = set()
+        if path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                self.index.update(f.read().splitlines())
+        segments = self.segments()
+        self.segment = len(segments) - 1
+        self.segment_records = 0
+        if segments:
+            with open(segments[-1], 'rb') as f:
+                self.segment_records = sum(1 for _ in f)
+        if self.segment < 0 or self.segment_records >= self.segment_size:
+            self.segment += 1
+            self.segment_records = 0
+
+    def segments(self):
+        return sorted(str(x) for x in Path(self.directory).glob('*.jsonl'))
+
+    def segment_path(self, n):
+        return path.join(self.directory, '%06d.jsonl' % (n,))
+
+    def has(self, name):
+        with self.lock:
+            return name in self.index
+
+    def put(self, name, record):
+        with self.lock:
+            self.index.add(name)
+            self.pending.append((name, json.dumps({'name': name, 'result': record}, ensure_ascii=False)))
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        pending = self.pending
+        while pending:
+            room = self.segment_size - self.segment_records
+            chunk, pending = pending[:room], pending[room:]
+            with open(self.segment_path(self.segment), 'a', encoding='utf-8') as f:
+                f.write(''.join(line + '\n' for _, line in chunk))
+            self.segment_records += len(chunk)
+            if self.segment_records >= self.segment_size:
+                self.segment += 1
+                self.segment_records = 0
+            # the index is written after the records: a crash in between only makes a repo analyzed twice
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(name + '\n' for name, _ in chunk))
+        self.pending = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def names(self):
+        with self.lock:
+            return list(self.index)
+
+    def parts(self):
+        """ (segment, numbers of its lines to read) of every segment """
+        self.flush()
+        segments = self.segments()
+        # where the last complete record of every name is, only the names are decoded
+        last = {}
+        for i, segment in enumerate(segments):
+            with open(segment, encoding='utf-8') as f:
+                for n, line in enumerate(f):
+                    if line.startswith(NAME_PREFIX) and line.endswith('}\n'):
+                        try:
+                            last[DECODER.raw_decode(line, len(NAME_PREFIX))[0]] = (i, n)
+                        except json.decoder.JSONDecodeError:
+                            pass
+        lines = [set() for _ in segments]
+        for i, n in last.values():
+            lines[i].add(n)
+        return list(zip(segments, lines))
+
+    def units(self):
+        """ (key, stamp, part, records) of every segment, the stamp changes when the segment is written and when
+        a later segment holds the last record of one of its names
+        """
+        units = []
+        for segment, lines in self.parts():
+            st = os.stat(segment)
+            digest = hashlib.sha1(' '.join(map(str, sorted(lines))).encode()).hexdigest()
+            units.append((segment, (st.st_mtime_ns, st.st_size, digest), (segment, lines), len(lines)))
+        return units
+
+    def records(self, part=None):
+        for segment, lines in self.parts() if part is None else [part]:
+            with open(segment, encoding='utf-8') as f:
+                for n, line in enumerate(f):
+                    try:
+                        line = json.loads(line)
+                    except json.decoder.JSONDecodeError:
+                        # the last line of a segment cut by a crash
+                        self.errors += 1
+                        continue
+                    if n in lines:
+                        yield line['name'], line['result']
+
+    def __len__(self):
+        with self.lock:
+            return len(self.index)
+
+    def close(self):
+        self.flush()
+
+
+def open_store(spec='results'):
+    """ sqlite:<file>, jsonl:<directory>, or a directory of json files like results/ """
+    kind, _, location = spec.partition(':')
+    if kind == 'sqlite':
+        return SqliteStore(location)
+    if kind == 'jsonl':
+        return JsonlStore(location)
+    return DirectoryStore(spec)
+
+
+def import_directory(store, directory='results'):
+    """ Copies the json files of a results/ directory into store, returns the number of records """
+    source = DirectoryStore(directory)
+    n = 0
+    for name, record in source.records():
+        store.put(name, record)
+        n += 1
+    store.flush()
+    return n, source.errors
+
+
+if __name__ == "__main__":
+    # python result_store.py sqlite:results.db [results]
+    if len(sys.argv) < 2:
+        sys.exit('usage: %s <store> [results directory]' % (sys.argv[0],))
+    store = open_store(sys.argv[1])
+    imported, errors = import_directory(store, sys.argv[2] if len(sys.argv) > 2 else 'results')
+    store.close()
+    print(f"Imported: {imported}, errors: {errors}")
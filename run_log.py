@@ -0,0 +1,90 @@
+import datetime
+import json
+import queue
+import threading
+
+# seconds between two flushes of the writer thread
+FLUSH_INTERVAL = 1.0
+
+
+class Counters:
+    """ One dict of counts per thread: the increments never contend, the totals are summed when read """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        # only taken the first time a thread counts something
+        self._lock = threading.Lock()
+
+    def incr(self, name, n=1):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        shard[name] = shard.get(name, 0) + n
+
+    def snapshot(self):
+        totals = {}
+        for shard in list(self._shards):
+            for name, n in dict(shard).items():
+                totals[name] = totals.get(name, 0) + n
+        return totals
+
+    def value(self, name):
+        return self.snapshot().get(name, 0)
+
+
+class RunLog:
+    """ Error records of a run, appended as JSONL by a single writer thread
+    log() only queues the record; every FLUSH_INTERVAL the writer appends the queued records,
+    one open per file, and snapshots the counters into the num_errors and counters files
+    """
+
+    def __init__(self, files, flush_interval=FLUSH_INTERVAL):
+        self.files = files
+        self.flush_interval = flush_interval
+        self.counters = Counters()
+        self.queue = queue.SimpleQueue()
+        self.stop = threading.Event()
+        self.written = None
+        self.thread = threading.Thread(target=self._write, name='run-log', daemon=True)
+        self.thread.start()
+
+    def log(self, kind, **fields):
+        """ counts the event and queues {"time": ..., "kind": kind, **fields} for LOG_FILES[kind] """
+        self.counters.incr(kind)
+        record = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'kind': kind}
+        record.update(fields)
+        self.queue.put(record)
+
+    def count(self, name, n=1):
+        self.counters.incr(name, n)
+
+    def _write(self):
+        while not self.stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        batches = {}
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batches.setdefault(record['kind'], []).append(json.dumps(record, ensure_ascii=False) + '\n')
+        for kind, lines in batches.items():
+            with open(self.files[kind], 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+        counts = self.counters.snapshot()
+        if counts != self.written:
+            with open(self.files['num_errors'], 'w') as f:
+                f.write(str(counts.get('num_errors', 0)))
+            with open(self.files['counters'], 'w') as f:
+                json.dump(counts, f, indent=4)
+            self.written = counts
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
@@ -0,0 +1,94 @@
+import threading
+
+# orders of the pending repos: as they come in the input, or the largest expected clone first
+ORDERS = ['input', 'largest']
+# picks a pending repo may be passed over by smaller ones that fit before it holds the rest back
+MAX_SKIPS = 64
+
+
+class DiskBudget:
+    """ Bytes the clones in temp/ may take together
+    A repo bigger than the whole budget is admitted alone, when nothing else is on disk
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def _fits(self, n):
+        return self.used == 0 or self.used + n <= self.budget
+
+    def try_reserve(self, n):
+        with self.cond:
+            if not self._fits(n):
+                return False
+            self.used += n
+            return True
+
+    def reserve(self, n):
+        with self.cond:
+            while not self._fits(n):
+                self.cond.wait()
+            self.used += n
+
+    def force(self, n):
+        with self.cond:
+            self.used += n
+
+    def release(self, n):
+        with self.cond:
+            self.used -= n
+            self.cond.notify_all()
+
+
+class CloneScheduler:
+    """ Chooses which of the pending repos is cloned next, from their expected sizes
+    With the input order the first repo waits until it fits in the budget; with the largest order
+    the largest repo that fits goes first, so the budget is filled with the small ones while a big one
+    waits, and the big ones do not end up in the tail of the run. A repo passed over MAX_SKIPS times
+    is not overtaken any more
+    """
+
+    def __init__(self, budget=None, order='input', max_skips=MAX_SKIPS):
+        self.budget = DiskBudget(budget) if budget else None
+        self.order = order
+        self.max_skips = max_skips
+
+    def reserve(self, n):
+        if self.budget is not None:
+            self.budget.reserve(n)
+
+    def release(self, n):
+        if self.budget is not None:
+            self.budget.release(n)
+
+    def pick(self, pending, idle=False):
+        """ index of the [size, skips, ...] entry of pending to start now, its size reserved, or None
+        idle: nothing is running, the first candidate is started even if it does not fit
+        """
+        if not pending:
+            return None
+        if self.order == 'largest':
+            candidates = sorted(range(len(pending)), key=lambda i: -pending[i][0])
+        else:
+            candidates = range(len(pending))
+        oldest = max(range(len(pending)), key=lambda i: pending[i][1])
+        if pending[oldest][1] >= self.max_skips:
+            candidates = [oldest]
+        for i in candidates:
+            if self.budget is None or self.budget.try_reserve(pending[i][0]):
+                break
+            if self.order != 'largest':
+                i = None
+                break
+        else:
+            i = None
+        if i is None and idle:
+            i = next(iter(candidates))
+            if self.budget is not None:
+                self.budget.force(pending[i][0])
+        if i is not None:
+            for entry in pending:
+                entry[1] += 1
+        return i
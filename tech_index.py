@@ -0,0 +1,101 @@
+import re
+import string
+from os import path
+
+# next to the module, the analyzer is imported from any working directory (benchmark.py, the tests)
+CONSTS_DIR = path.join(path.dirname(path.abspath(__file__)), 'consts')
+
+# category -> consts files the category is loaded from
+CONSTS_FILES = {
+    'dbs': ['db.csv', 'db-2.csv'], 'servers': ['server.csv'], 'buses': ['bus.csv'], 'langs': ['lang.csv'],
+    'gates': ['gateway.csv'], 'monitors': ['monitor.csv'], 'discos': ['discovery.csv']
+}
+
+_SEPARATORS = str.maketrans(string.punctuation + string.digits, ' ' * len(string.punctuation + string.digits))
+
+# nltk.word_tokenize splits these off as tokens of their own, and splits a few contractions
+_SPLIT_CHARS = '«“‘„»”’\u2012-\u2015'
+_TOKEN = re.compile('[%s]|[^\\s%s]+' % (_SPLIT_CHARS, _SPLIT_CHARS))
+_CONTRACTIONS = {
+    'cannot': ('can', 'not'), 'gimme': ('gim', 'me'), 'gonna': ('gon', 'na'), 'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'), 'wanna': ('wan', 'na')
+}
+
+# tokens shorter than this are dropped by get_words, so single-word entries are only matched above it
+MIN_TOKEN_LEN = 3
+
+
+def load_data(consts_dir=CONSTS_DIR):
+    data = {}
+    for category, files in CONSTS_FILES.items():
+        names = []
+        for name in files:
+            with open(path.join(consts_dir, name)) as f:
+                names += [x.lower() for x in f.read().splitlines()]
+        data[category] = list(set(names)) if len(files) > 1 else names
+    return data
+
+
+def tokenize(data):
+    """ Same tokens nltk.word_tokenize gives once punctuation and digits are blanked out """
+    tokens = []
+    for w in _TOKEN.findall(data.translate(_SEPARATORS).lower()):
+        if w in _CONTRACTIONS:
+            tokens.extend(_CONTRACTIONS[w])
+        else:
+            tokens.append(w)
+    return tokens
+
+
+def phrase_tokens(name):
+    return tuple(tokenize(name))
+
+
+class TechIndex:
+    """ Hashed token -> (category, canonical name) index over the consts lists
+    Single-word entries are matched by exact token equality, multi-word entries ("amazon mq")
+    by a run of consecutive tokens; lookups cost O(1) per token instead of a scan of the list
+    """
+
+    def __init__(self, data):
+        self.categories = list(data)
+        # name -> {category: canonical name}
+        self.names = {}
+        # first token -> [(phrase tokens, category, canonical name)], longest phrase first
+        self.phrases = {}
+        for category, names in data.items():
+            for name in names:
+                self.names.setdefault(name, {}).setdefault(category, name)
+                if ' ' not in name:
+                    continue
+                tokens = phrase_tokens(name)
+                if len(tokens) > 1:
+                    self.phrases.setdefault(tokens[0], []).append((tokens, category, name))
+        for candidates in self.phrases.values():
+            candidates.sort(key=lambda x: -len(x[0]))
+
+    def match_one(self, name, category):
+        res = self.names.get(name)
+        if res and category in res:
+            return [res[category]]
+        return []
+
+    def iter_matches(self, tokens, category):
+        tokens = tokens if isinstance(tokens, (list, tuple)) else list(tokens)
+        for i, token in enumerate(tokens):
+            for phrase, c, name in self.phrases.get(token, ()):
+                if c == category and tuple(tokens[i:i + len(phrase)]) == phrase:
+                    yield name
+                    break
+            if len(token) >= MIN_TOKEN_LEN:
+                res = self.names.get(token)
+                if res and category in res:
+                    yield res[category]
+
+    def match_ones(self, tokens, category):
+        for name in self.iter_matches(tokens, category):
+            return [name]
+        return []
+
+    def match_alls(self, tokens, category):
+        return list(set(self.iter_matches(tokens, category)))
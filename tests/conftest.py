@@ -0,0 +1,45 @@
+import subprocess
+import sys
+from os import path
+
+import pytest
+
+# the modules of the analyzer are at the root of the repository, not in a package
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+
+def run_git(*args, cwd=None):
+    return subprocess.run(['git'] + list(args), cwd=cwd, check=True, stdout=subprocess.PIPE).stdout.decode()
+
+
+@pytest.fixture
+def git():
+    return run_git
+
+
+@pytest.fixture
+def bare_repo(tmp_path):
+    """ makes bare_repo(name, files) a bare repo of one commit with the files (path -> text), returns its path
+    commit(name, files) adds a commit to it
+    """
+    def commit(name, files):
+        work = tmp_path / 'work' / name
+        if not work.exists():
+            run_git('clone', '-q', str(tmp_path / ('%s.git' % (name,))), str(work))
+        for rel_path, text in files.items():
+            (work / rel_path).parent.mkdir(parents=True, exist_ok=True)
+            (work / rel_path).write_text(text)
+        run_git('add', '.', cwd=work)
+        run_git('-c', 'user.name=a', '-c', 'user.email=a@b', 'commit', '-qm', 'change', cwd=work)
+        run_git('push', '-q', 'origin', 'HEAD', cwd=work)
+
+    def make(name, files):
+        bare = tmp_path / ('%s.git' % (name,))
+        run_git('init', '-q', '--bare', str(bare))
+        # partial clones over file:// need it like on a server
+        run_git('config', 'uploadpack.allowFilter', 'true', cwd=bare)
+        commit(name, files)
+        return str(bare)
+
+    make.commit = commit
+    return make
@@ -0,0 +1,41 @@
+import analyze_repo_multi_trhead as analyzer
+from git_backend import GitObjectSource, index_tree
+from repo_index import index_repo
+
+# directory names the file system is unlikely to list in name order
+SERVICES = ['zeta', 'alpha', 'mike', 'bravo', 'yankee', 'charlie', 'x-ray', 'delta', 'Echo', 'echo2']
+FILES = {'docker-compose.yml': 'services:\n' + ''.join('  %s:\n    build: ./%s\n' % (s.lower(), s) for s in SERVICES)}
+for s in SERVICES:
+    FILES['%s/Dockerfile' % (s,)] = 'FROM node:%d\n' % (len(s),)
+    FILES['%s/package.json' % (s,)] = '{"dependencies": {"express": "4", "mongodb": "3"}}\n'
+    FILES['%s/src/main.js' % (s,)] = 'console.log(%r)\n' % (s,)
+    FILES['%s/src/lib/util.js' % (s,)] = '// util\n'
+
+
+def analyze(workdir, source=None, sparse=False):
+    analysis = {}
+    analyzer.analyze_clone(workdir, analysis, source, sparse=sparse)
+    del analysis['timings']
+    return analysis
+
+
+def test_indexes_list_in_the_same_order(bare_repo, git, tmp_path):
+    remote = bare_repo('remote', FILES)
+    git('clone', '-q', remote, str(tmp_path / 'clone'))
+    walked = index_repo(str(tmp_path / 'clone'))
+    listed = index_tree(remote)
+    assert walked.files == listed.files
+    assert walked.entries == listed.entries
+
+
+def test_backends_give_the_same_result(bare_repo, git, tmp_path):
+    remote = bare_repo('remote', FILES)
+    git('clone', '-q', remote, str(tmp_path / 'clone'))
+    worktree = analyze(str(tmp_path / 'clone'))
+    with GitObjectSource(remote) as source:
+        odb = analyze(remote, source)
+    assert worktree == odb
+    analyzer.fetch_repo('file://' + remote, str(tmp_path), 'sparse-clone', 'sparse')
+    sparse = analyze(str(tmp_path / 'sparse-clone'), sparse=True)
+    for key in ('dockers', 'files', 'structure'):
+        assert sparse[key] == worktree[key]
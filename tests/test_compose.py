@@ -0,0 +1,22 @@
+import compose
+
+
+def test_stacks_of_a_directory_with_a_base_file():
+    paths = ['/a/docker-compose.prod.yml', '/a/docker-compose.override.yml', '/a/docker-compose.yml']
+    assert compose.stacks(paths) == [(['/a/docker-compose.yml', '/a/docker-compose.override.yml'], True),
+                                     (['/a/docker-compose.yml', '/a/docker-compose.prod.yml'], False)]
+
+
+def test_stacks_without_a_base_file_do_not_depend_on_the_listing_order():
+    paths = ['/a/docker-compose.prod.yml', '/a/compose.dev.yaml', '/a/docker-compose.override.yml']
+    expected = [(['/a/docker-compose.override.yml'], True), (['/a/compose.dev.yaml'], False),
+                (['/a/docker-compose.prod.yml'], False)]
+    assert compose.stacks(paths) == expected
+    assert compose.stacks(list(reversed(paths))) == expected
+    variants = ['/b/docker-compose.test.yml', '/b/docker-compose.prod.yml']
+    assert compose.stacks(variants) == compose.stacks(list(reversed(variants))) == [
+        (['/b/docker-compose.prod.yml'], True), (['/b/docker-compose.test.yml'], False)]
+
+
+def test_a_lone_override_file_is_a_stack():
+    assert compose.stacks(['/a/docker-compose.override.yml']) == [(['/a/docker-compose.override.yml'], True)]
@@ -0,0 +1,26 @@
+import pytest
+
+import analyze_repo_multi_trhead as analyzer
+
+SOURCES = {'src/module%d/code%d.py' % (i % 5, i): 'print(%d)\n' % (i,) * 50 for i in range(30)}
+MANIFESTS = {'Dockerfile': 'FROM python:3\n',
+             'docker-compose.yml': 'services:\n  web:\n    build: .\n  db:\n    image: mysql\n'}
+
+
+@pytest.mark.parametrize('strategy', ['sparse', 'shallow'])
+def test_partial_clone_fetches_only_the_manifests(bare_repo, git, tmp_path, strategy):
+    remote = 'file://' + bare_repo('remote', dict(SOURCES, **MANIFESTS))
+    analyzer.fetch_repo(remote, str(tmp_path), 'clone', strategy)
+    workdir = str(tmp_path / 'clone')
+    analysis = {}
+    analyzer.analyze_clone(workdir, analysis, sparse=True, metadata={'size': 7})
+    # --missing=print lists the objects the partial clone does not have, without fetching them
+    objects = git('rev-list', '--objects', '--missing=print', 'HEAD', cwd=workdir).split('\n')
+    missing = {line[1:] for line in objects if line.startswith('?')}
+    sources = {line.split()[2] for line in git('ls-tree', '-r', 'HEAD', 'src', cwd=workdir).splitlines()}
+    assert len(sources) == len(SOURCES)
+    assert missing == sources
+    assert analysis['size'] == 7
+    assert analysis['languages'] == ['python']
+    assert analysis['num_dockers'] == 1
+    assert analysis['structure']['num_services'] == 2
@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from metadata import GitHubClient, MetadataCache, MetadataPrefetcher
+
+
+class StubGitHub(BaseHTTPRequestHandler):
+    """ /repos/<user>/<repo> and /graphql of the GitHub API, the size of a repo is the length of its name """
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    delay = 0
+
+    def answer(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path))
+        name = self.path[len('/repos/'):]
+        if name.startswith('missing'):
+            self.answer(404, {'message': 'Not Found'})
+        else:
+            self.answer(200, {'full_name': name, 'size': len(name)})
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['query']
+        self.requests.append(('POST', self.path))
+        time.sleep(self.delay)
+        data = {}
+        for field in query[len('query { '):-len(' }')].split(' { diskUsage }')[:-1]:
+            alias, rest = field.strip().split(': ', 1)
+            owner = json.loads(rest.split('owner: ')[1].split(', name: ')[0])
+            repo = json.loads(rest.split('name: ')[1].rstrip(')'))
+            data[alias] = {'diskUsage': len('%s/%s' % (owner, repo))}
+        self.answer(200, {'data': data})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    StubGitHub.requests = []
+    StubGitHub.delay = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubGitHub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % (server.server_address[1],)
+    server.shutdown()
+    server.server_close()
+
+
+def prefetcher(api, tmp_path, token=None):
+    return MetadataPrefetcher(MetadataCache(str(tmp_path / 'metadata.db')), GitHubClient(api, token=token),
+                              batch_size=10)
+
+
+def test_prefetch_in_graphql_batches(api, tmp_path):
+    metadata = prefetcher(api, tmp_path, token='t')
+    names = ['user%d/repo' % (i,) for i in range(25)]
+    metadata.prefetch(names)
+    metadata.join()
+    assert StubGitHub.requests == [('POST', '/graphql')] * 3
+    assert [metadata.get(name)['size'] for name in names] == [len(name) for name in names]
+    # the lookups of the workers are local
+    assert len(StubGitHub.requests) == 3
+    metadata.close()
+
+
+def test_rest_lookups_are_cached(api, tmp_path):
+    metadata = prefetcher(api, tmp_path)
+    assert metadata.get('user/repo') == {'size': 9}
+    assert metadata.get('missing/repo') == {}
+    assert metadata.get('user/repo') == {'size': 9}
+    assert metadata.get('missing/repo') == {}
+    assert StubGitHub.requests == [('GET', '/repos/user/repo'), ('GET', '/repos/missing/repo')]
+    metadata.close()
+
+
+def test_lookups_do_not_wait_for_the_prefetch(api, tmp_path):
+    StubGitHub.delay = 1
+    metadata = prefetcher(api, tmp_path, token='t')
+    start = time.time()
+    metadata.prefetch(['user%d/repo' % (i,) for i in range(10)])
+    # the next batch is queued at once, the previous one still being fetched
+    metadata.prefetch(['next%d/repo' % (i,) for i in range(10)])
+    assert time.time() - start < 0.5
+    time.sleep(0.2)
+    # a worker asking for a repo not prefetched yet gets it over a connection of its own
+    assert metadata.get('other/repo') == {'size': 10}
+    assert time.time() - start < 0.8
+    metadata.join()
+    assert metadata.cache.get('next9/repo') == {'size': 10}
+    metadata.close()
@@ -0,0 +1,39 @@
+import result_aggregate
+from result_aggregate import KEYS, SIZE_KEYS, fold, init_worker, pending_targets, read_targets, read_units
+from result_store import open_store
+
+
+def result(url, commit, structure=None):
+    data = {key: [] for key in KEYS}
+    data.update({key: 0 for key in SIZE_KEYS})
+    data.update(url=url, commit=commit, num_services=3, structure=structure)
+    return data
+
+
+def test_only_the_included_results_and_the_targets_of_links_are_read(tmp_path, monkeypatch):
+    spec = 'jsonl:%s' % (tmp_path / 'results',)
+    store = open_store(spec)
+    store.put('a', result('https://github.com/o/a', 'c1', {'dep_graph_full': {'nodes': 1}, 'dep_graph_micro': {}}))
+    # out of the include set, the empty structure of a repo without services has no dependency graphs
+    store.put('b', result('https://github.com/o/b', 'c2', {'path': [], 'num_services': 0, 'services': []}))
+    store.put('c', result('https://github.com/o/c', 'c3'))
+    store.put('d', {'url': 'https://github.com/o/d', 'duplicate_of': 'b', 'commit': 'c2'})
+    store.close()
+    read = []
+    contribution = result_aggregate.contribution
+    monkeypatch.setattr(result_aggregate, 'contribution',
+                        lambda data, min_services=0: read.append(data['url']) or contribution(data, min_services))
+    init_worker(spec, {'https://github.com/o/a', 'https://github.com/o/d'})
+    units = [(key, part) for key, _, part, _ in open_store(spec).units()]
+    units = read_units(units)
+    assert read == ['https://github.com/o/a']
+    read.clear()
+    pending = pending_targets(units)
+    assert list(pending.values()) == [{'b'}]
+    units = [read_targets(part, pending[key], entries) if key in pending else entries
+             for (key, entries), (_, _, part, _) in zip(units, open_store(spec).units())]
+    assert read == ['https://github.com/o/b']
+    aggregate = fold(units)
+    assert aggregate.total == 4
+    assert aggregate.analyzed == 2
+    assert aggregate.dep_graphs == [{'full': {'nodes': 1}, 'micro': {}}, {'full': None, 'micro': None}]
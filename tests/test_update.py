@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import analyze_repo_multi_trhead as analyzer
+from mirrors import MirrorCache
+from result_store import open_store
+
+FILES = {'Dockerfile': 'FROM python:3\n', 'app.py': 'print(1)\n'}
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    """ run(repos, update) analyzes the (url, project id) repos into the results of tmp_path,
+    returns the records by name and the counters of the run
+    """
+    workdir = tmp_path / 'run'
+    (workdir / 'repos').mkdir(parents=True)
+    monkeypatch.chdir(workdir)
+    monkeypatch.setattr(analyzer, 'send_email_notification', lambda content: None)
+
+    def run_once(repos, update=False, **kwargs):
+        with open('repos/a.csv', 'w') as f:
+            f.write('URL,ProjectID\n' + ''.join('%s,%s\n' % repo for repo in repos))
+        analyzer.create_log_file()
+        analyzer.analyze_all(results='jsonl:results', update=update, dedup=True, **dict({'max_workers': 2}, **kwargs))
+        counters = analyzer.RUN_LOG.counters.snapshot()
+        return dict(open_store('jsonl:results').records()), counters
+    return run_once
+
+
+@pytest.fixture
+def remotes(bare_repo, tmp_path):
+    # read_repos only keeps the github urls
+    os.makedirs(tmp_path / 'github')
+    return lambda name, files: 'file://' + bare_repo('github/' + name, files)
+
+
+def test_moved_heads_and_forks(remotes, bare_repo, run):
+    upstream = remotes('upstream', FILES)
+    fork = remotes('fork', FILES)
+    other = remotes('other', dict(FILES, **{'other.py': 'print(2)\n'}))
+    repos = [(upstream, 'u/upstream'), (fork, 'u/fork'), (other, 'u/other')]
+
+    results, counters = run(repos)
+    assert results['u/fork']['duplicate_of'] == 'u/upstream'
+    assert results['u/fork']['commit'] == results['u/upstream']['commit']
+    assert 'duplicate_of' not in results['u/other']
+    assert counters['duplicates'] == 1
+
+    # nothing moved
+    results, counters = run(repos, update=True)
+    assert counters == {'unchanged': 3}
+
+    # the HEAD of one repo moves, only that one is analyzed again
+    bare_repo.commit('github/other', {'new.py': 'print(3)\n'})
+    before = results
+    results, counters = run(repos, update=True)
+    assert counters == {'unchanged': 2, 'refreshed': 1}
+    assert results['u/other']['commit'] != before['u/other']['commit']
+    assert results['u/upstream'] == before['u/upstream']
+
+    # the repo a fork is linked to moves: the fork no longer shares its HEAD and gets a result of its own
+    bare_repo.commit('github/upstream', {'new.py': 'print(4)\n'})
+    before = results
+    results, counters = run(repos, update=True)
+    assert counters == {'unchanged': 1, 'refreshed': 1, 'relinked': 1}
+    assert results['u/upstream']['commit'] != before['u/upstream']['commit']
+    assert results['u/fork']['commit'] == before['u/fork']['commit']
+    assert 'duplicate_of' not in results['u/fork']
+    assert results['u/other'] == before['u/other']
+
+
+@pytest.mark.parametrize('mode', [{'max_workers': 2}, {'pipeline_limits': {}}])
+def test_forks_are_analyzed_when_the_repo_they_wait_for_fails(remotes, run, monkeypatch, mode):
+    upstream = remotes('upstream', FILES)
+    repos = [(upstream, 'u/upstream')] + [(remotes('fork%d' % (i,), FILES), 'u/fork%d' % (i,)) for i in range(3)]
+    clone = analyzer.clone
+    monkeypatch.setattr(analyzer, 'clone', lambda url, name, *args, **kwargs:
+                        None if name == 'u/upstream' else clone(url, name, *args, **kwargs))
+    results, counters = run(repos, **mode)
+    assert sorted(results) == ['u/fork0', 'u/fork1', 'u/fork2']
+    assert 'duplicate_of' not in results['u/fork0']
+    assert results['u/fork1']['duplicate_of'] == results['u/fork2']['duplicate_of'] == 'u/fork0'
+    assert counters['duplicates'] == 2
+
+
+def test_mirror_fetches_the_moved_head(bare_repo, git, tmp_path):
+    remote = bare_repo('remote', FILES)
+    git('update-ref', 'refs/pull/1/head', 'HEAD', cwd=remote)
+    cache = MirrorCache(str(tmp_path / 'mirrors'))
+    with cache.mirror('file://' + remote) as mirror:
+        first = git('rev-parse', 'HEAD', cwd=mirror).strip()
+    bare_repo.commit('remote', {'new.py': 'print(1)\n'})
+    with cache.mirror('file://' + remote) as mirror:
+        assert git('rev-parse', 'HEAD', cwd=mirror).strip() == git('rev-parse', 'HEAD', cwd=remote).strip() != first
+        refs = git('for-each-ref', '--format=%(refname)', cwd=mirror).split()
+    assert 'refs/pull/1/head' not in refs
+    assert cache.report() == 'Mirror cache: 1 fetched, 1 cloned'
+    cache.close()